@@ -1,4 +1,5 @@
-from typing import List, Optional
+from enum import Enum
+from typing import Dict, List, Optional
 
 from aars import Index
 from pydantic import BaseModel
@@ -11,7 +12,7 @@ from ..core.model import (
     Comment,
     Payment,
 )
-
+from ..core.sales_stats import Granularity
 
 Index(Service, "owner_address")
 
@@ -70,3 +71,46 @@ class PutUserInfo(BaseModel):
 
 class MessageResponse(BaseModel):
     response: str
+
+
+class ExportRecordType(str, Enum):
+    SERVICES = "services"
+    USERS = "users"
+    PERMISSIONS = "permissions"
+    PAYMENTS = "payments"
+    COMMENTS = "comments"
+    VOTES = "votes"
+
+
+class SalesStatsBucket(BaseModel):
+    start: Optional[int]
+    sales: int
+    revenue: Dict[str, str]
+    unique_buyers: int
+
+
+class OwnerStatsResponse(BaseModel):
+    owner_address: str
+    service_id: Optional[str]
+    granularity: Granularity
+    total: SalesStatsBucket
+    buckets: List[SalesStatsBucket]
+
+
+class FeedRecordType(str, Enum):
+    SERVICE = "Service"
+    COMMENT = "Comment"
+    VOTE = "Vote"
+    PERMISSION = "Permission"
+    PAYMENT = "Payment"
+    USER_INFO = "UserInfo"
+
+
+class RelatedService(BaseModel):
+    service_id: str
+    score: float
+
+
+class RelatedServicesResponse(BaseModel):
+    also_bought: List[RelatedService]
+    similar: List[RelatedService]
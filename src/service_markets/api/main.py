@@ -2,18 +2,36 @@ import asyncio
 import logging
 import os
 from os import listdir
-from typing import Optional
 
-from aars import AARS, Record
+from aars import AARS
 from aleph.sdk.vm.app import AlephApp
 from aleph_message.models import PostMessage
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi_walletauth import authorization_routes
 
+from ..core.aleph_client import (
+    AlephDeadlineExceeded,
+    AlephUnavailable,
+    DeadlineMiddleware,
+)
 from ..core.constants import API_MESSAGE_FILTER, SERVICE_MARKETS_MESSAGE_CHANNEL
+from ..core.generations import index_manager, index_post
+from ..core.profiler import ProfilerMiddleware, profiling_available
+from ..core.recommendations import (
+    RELATED_RECOMPUTE_INTERVAL,
+    recompute_periodically,
+    related_services,
+)
+from ..core.reconcile import RECONCILE_INTERVAL, reconcile_periodically
 from ..core.session import initialize_aars
+from ..core.shards import ShardMiddleware, shard_manager
 from .routers import (
+    admin,
+    export,
+    feed,
+    owners,
     services,
     users,
 )
@@ -34,25 +52,59 @@ http_app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if shard_manager.enabled:
+    http_app.add_middleware(ShardMiddleware)
+http_app.add_middleware(DeadlineMiddleware)
+if profiling_available():
+    http_app.add_middleware(ProfilerMiddleware)
 
 http_app.include_router(services.router)
 http_app.include_router(users.router)
+http_app.include_router(export.router)
+http_app.include_router(owners.router)
+http_app.include_router(feed.router)
+http_app.include_router(admin.router)
 http_app.include_router(authorization_routes)
 
+
+@http_app.exception_handler(AlephUnavailable)
+async def aleph_unavailable_handler(request: Request, exc: AlephUnavailable):
+    return JSONResponse(
+        status_code=503, content={"detail": "Aleph API is currently unavailable"}
+    )
+
+
+@http_app.exception_handler(AlephDeadlineExceeded)
+async def aleph_deadline_handler(request: Request, exc: AlephDeadlineExceeded):
+    return JSONResponse(
+        status_code=504, content={"detail": "Aleph API did not answer in time"}
+    )
+
+
 app = AlephApp(http_app=http_app)
 
 
 async def re_index():
     logger.info(f"API re-indexing channel {AARS.channel}")
-    await asyncio.wait_for(AARS.sync_indices(), timeout=None)
+    await index_manager.rebuild()
     logger.info("API re-indexing done")
 
 
 @app.on_event("startup")
 async def startup():
     app.aars = await initialize_aars()
+    if shard_manager.enabled:
+        shard_manager.install()
     print("Syncing indices...")
     await re_index()
+    if RECONCILE_INTERVAL > 0:
+        app.reconcile_task = asyncio.ensure_future(
+            reconcile_periodically(RECONCILE_INTERVAL)
+        )
+    if RELATED_RECOMPUTE_INTERVAL > 0:
+        app.related_task = asyncio.ensure_future(
+            recompute_periodically(related_services, RELATED_RECOMPUTE_INTERVAL)
+        )
 
 
 @app.get("/")
@@ -84,19 +136,5 @@ async def address():
 
 @app.event(filters=API_MESSAGE_FILTER)
 async def fishnet_event(event: PostMessage):
-    record: Optional[Record]
     print("fishnet_event", event)
-    api_message_filter_without_amend = API_MESSAGE_FILTER.copy()
-    api_message_filter_without_amend.remove("amend")
-    if event.content.type in api_message_filter_without_amend:
-        if Record.is_indexed(event.item_hash):
-            return
-        cls: Record = globals()[event.content.type]
-        record = await cls.from_post(event)
-    else:  # amend
-        if Record.is_indexed(event.content.ref):
-            return
-        record = await Record.fetch(event.content.ref).first()
-    assert record
-    for inx in record.get_indices():
-        inx.add_record(record)
+    await index_post(event)
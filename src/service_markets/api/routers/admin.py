@@ -0,0 +1,135 @@
+from typing import Dict
+
+from aars import AARS
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi_walletauth import WalletAuth, WalletAuthDep
+
+from ...core.admission import rate_limiter, write_gate
+from ...core.aleph_client import ResilientAlephClient, request_deadline
+from ...core.compact import compact_store
+from ...core.constants import SERVICE_MARKETS_MANAGER_PUBKEYS
+from ...core.feed import change_feed
+from ...core.generations import index_manager
+from ...core.indexing import local
+from ...core.profiler import profile_store
+from ...core.reconcile import ReconcileReport, reconcile, reconcile_lock
+from ...core.shards import shard_manager
+
+
+async def get_manager_wallet(wallet: WalletAuthDep) -> WalletAuth:
+    if wallet.address not in SERVICE_MARKETS_MANAGER_PUBKEYS:
+        raise HTTPException(
+            status_code=403,
+            detail="address is not a service.markets manager",
+        )
+    return wallet
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    responses={403: {"description": "Not a manager"}},
+    dependencies=[Depends(get_manager_wallet)],
+)
+
+
+@router.get("/admission")
+async def get_admission_stats() -> Dict:
+    """
+    Get the rate limiter and write queue statistics, including rejection counts per route.
+    """
+    return {
+        "rate_limiter": rate_limiter.stats(),
+        "write_gate": write_gate.stats(),
+    }
+
+
+@router.get("/aleph")
+async def get_aleph_client_stats() -> Dict:
+    """
+    Get the call, retry and hedging counters and the circuit breaker state of the Aleph client.
+    """
+    if not isinstance(AARS.session, ResilientAlephClient):
+        raise HTTPException(
+            status_code=404, detail="Aleph client does not collect statistics"
+        )
+    return AARS.session.stats()
+
+
+@router.get("/feed")
+async def get_feed_stats() -> Dict:
+    """
+    Get the number of feed subscribers, published events and evicted slow subscribers.
+    """
+    return local(change_feed).stats()
+
+
+@router.post("/reindex", status_code=202)
+async def start_reindex() -> Dict:
+    """
+    Rebuild all indices in the background and swap them in once done.
+    The current indices keep serving requests in the meantime.
+    """
+    manager = local(index_manager)
+    if not manager.start():
+        raise HTTPException(status_code=409, detail="Re-indexing already running")
+    return manager.stats()
+
+
+@router.get("/reindex")
+async def get_reindex_progress() -> Dict:
+    """
+    Get the current index generation and the progress of a running re-index.
+    """
+    return local(index_manager).stats()
+
+
+@router.get("/memory")
+async def get_memory_report() -> Dict:
+    """
+    Get the bytes per indexed permission and vote as pydantic models and in the compact storage.
+    """
+    return local(compact_store).memory_report()
+
+
+@router.post("/reconcile")
+async def run_reconcile(dry_run: bool = False, full: bool = False) -> ReconcileReport:
+    """
+    Reconcile payments and permissions with the Request Network subgraph.
+    Use `dry_run` to only report what would be created and `full` to ignore the checkpoint.
+    """
+    if reconcile_lock.locked():
+        raise HTTPException(status_code=409, detail="Reconciliation already running")
+    # reconciling can take much longer than the usual request deadline
+    request_deadline.set(None)
+    return await reconcile(dry_run=dry_run, full=full)
+
+
+@router.get("/profiles")
+async def get_profiles() -> Dict:
+    """
+    List the most recent on-demand profiles and the slowest requests.
+    """
+    return profile_store.summary()
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str) -> str:
+    """
+    Get a request profile as collapsed stacks, to be loaded into flamegraph.pl or speedscope.
+    """
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="No Profile found")
+    if not profile.stacks:
+        raise HTTPException(status_code=404, detail="Request was not sampled")
+    return profile.stacks
+
+
+@router.get("/shards")
+async def get_shards() -> Dict:
+    """
+    Get the channels this API may serve and the state of the loaded ones.
+    """
+    return shard_manager.stats()
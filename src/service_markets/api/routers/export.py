@@ -0,0 +1,137 @@
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Set, Type
+
+from aars import AARS, Record
+from aleph_message.models import MessageType, PostMessage
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from ...core.aleph_client import request_deadline
+from ...core.model import (
+    Service,
+    UserInfo,
+    Permission,
+    Payment,
+    Comment,
+    Vote,
+)
+from ..api_model import ExportRecordType
+
+router = APIRouter(
+    prefix="/export",
+    tags=["export"],
+    responses={404: {"description": "Not found"}},
+)
+
+EXPORT_RECORD_TYPES: Dict[ExportRecordType, Type[Record]] = {
+    ExportRecordType.SERVICES: Service,
+    ExportRecordType.USERS: UserInfo,
+    ExportRecordType.PERMISSIONS: Permission,
+    ExportRecordType.PAYMENTS: Payment,
+    ExportRecordType.COMMENTS: Comment,
+    ExportRecordType.VOTES: Vote,
+}
+
+# Flush the gzip stream after this many uncompressed bytes, so that the client
+# receives data continuously instead of one chunk at the very end.
+GZIP_FLUSH_THRESHOLD = 64 * 1024
+# AARS returns a single page when fetching records by hash, so batches must fit into one
+EXPORT_BATCH_SIZE = 50
+CHANGES_PAGE_SIZE = 200
+
+
+def indexed_hashes(record_type: Type[Record]) -> Set[str]:
+    """
+    Get the item hashes of all indexed records of a type, from the first of its indices.
+    """
+    item_hashes: Set[str] = set()
+    for bucket in record_type.get_indices()[0].hashmap.values():
+        item_hashes.update(bucket)
+    return item_hashes
+
+
+async def changed_hashes(record_type: Type[Record], since: float) -> Set[str]:
+    """
+    Get the item hashes of records posted or amended after `since`, from the messages posted since then.
+    Amends are not typed, so these may include records of other types.
+    """
+    item_hashes: Set[str] = set()
+    page = 1
+    while True:
+        response = await AARS.session.get_messages(
+            pagination=CHANGES_PAGE_SIZE,
+            page=page,
+            message_type=MessageType.post,
+            content_types=[record_type.__name__, "amend"],
+            channels=[AARS.channel],
+            start_date=since,
+        )
+        for message in response.messages:
+            if not isinstance(message, PostMessage):
+                continue
+            ref = message.content.ref
+            if ref is None:
+                item_hashes.add(message.item_hash)
+            else:
+                item_hashes.add(ref if isinstance(ref, str) else ref.item_hash)
+        if page * response.pagination_per_page >= response.pagination_total:
+            return item_hashes
+        page += 1
+
+
+async def iter_ndjson(
+    record_type: Type[Record], since: Optional[float] = None
+) -> AsyncIterator[bytes]:
+    """
+    Yield one newline-terminated JSON document per indexed record, fetching records lazily in batches.
+    """
+    # exports outlive the request deadline, each Aleph call keeps its own timeout
+    request_deadline.set(None)
+    item_hashes = indexed_hashes(record_type)
+    if since is not None:
+        item_hashes &= await changed_hashes(record_type, since)
+    pending: List[str] = list(item_hashes)
+    for start in range(0, len(pending), EXPORT_BATCH_SIZE):
+        batch = pending[start : start + EXPORT_BATCH_SIZE]
+        async for record in AARS.fetch_records(
+            record_type, batch, page_size=EXPORT_BATCH_SIZE
+        ):
+            yield record.json(by_alias=True).encode() + b"\n"
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Compress a byte stream on the fly into a single gzip member.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    pending = 0
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= GZIP_FLUSH_THRESHOLD:
+            compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@router.get("/{record_type}.ndjson")
+async def export_records(
+    record_type: ExportRecordType,
+    since: Optional[float] = None,
+    gzip: bool = False,
+) -> StreamingResponse:
+    """
+    Stream all records of a given type as newline-delimited JSON.
+    Use `since` (unix timestamp) to only export records created or amended after that time,
+    and `gzip` to receive a gzip-encoded stream.
+    """
+    body = iter_ndjson(EXPORT_RECORD_TYPES[record_type], since)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{record_type.value}.ndjson"'
+    }
+    if gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from os import getenv
+from typing import AsyncIterator, List
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from ...core.feed import ChangeFeed, FeedFull, FeedSubscriber, change_feed
+from ...core.indexing import local
+from ..api_model import FeedRecordType
+
+FEED_KEEP_ALIVE_INTERVAL = float(getenv("FEED_KEEP_ALIVE_INTERVAL", 15))
+
+router = APIRouter(
+    prefix="/feed",
+    tags=["feed"],
+    responses={503: {"description": "Too many subscribers"}},
+)
+
+
+async def stream_events(
+    feed: ChangeFeed, subscriber: FeedSubscriber
+) -> AsyncIterator[str]:
+    try:
+        while not (subscriber.evicted and subscriber.queue.empty()):
+            try:
+                event = await asyncio.wait_for(
+                    subscriber.queue.get(), FEED_KEEP_ALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: change\ndata: {json.dumps(event)}\n\n"
+        yield "event: evicted\ndata: {}\n\n"
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+@router.get("")
+async def subscribe_feed(
+    service_id: List[str] = Query([]),
+    record_type: List[FeedRecordType] = Query([]),
+    owner: List[str] = Query([]),
+) -> StreamingResponse:
+    """
+    Subscribe to a server-sent events stream of marketplace changes.
+    Filter by one or more `service_id`, `record_type` or service `owner`; an empty filter matches everything.
+    Clients that do not keep up with the stream receive an `evicted` event and are disconnected.
+    """
+    feed = local(change_feed)
+    try:
+        subscriber = feed.subscribe(
+            service_ids=set(service_id),
+            record_types={t.value for t in record_type},
+            owners=set(owner),
+        )
+    except FeedFull:
+        raise HTTPException(status_code=503, detail="Too many feed subscribers")
+    return StreamingResponse(
+        stream_events(feed, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from ...core.indexing import local
+from ...core.sales_stats import Granularity, SalesBucket, SalesSeries, sales_stats
+from ..api_model import OwnerStatsResponse, SalesStatsBucket
+
+router = APIRouter(
+    prefix="/owners",
+    tags=["owners"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def to_stats_bucket(bucket: SalesBucket, start: Optional[int] = None):
+    return SalesStatsBucket(
+        start=start,
+        sales=bucket.sales,
+        revenue={token: f"{amount:f}" for token, amount in bucket.revenue.items()},
+        unique_buyers=len(bucket.buyers),
+    )
+
+
+@router.get("/{address}/stats")
+async def get_owner_stats(
+    address: str,
+    service_id: Optional[str] = None,
+    granularity: Granularity = Granularity.DAY,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> OwnerStatsResponse:
+    """
+    Get sales, revenue per token and unique buyers of an owner's services, in total and per hour or day.
+    Use `service_id` to only get the stats of one service, and `since`/`until` (unix timestamps) to limit the buckets.
+    """
+    stats = local(sales_stats)
+    if service_id:
+        if stats.service_owners.get(service_id) != address:
+            raise HTTPException(status_code=404, detail="No Service found")
+        series = stats.services.get(service_id)
+    else:
+        series = stats.owners.get(address)
+    if series is None:
+        series = SalesSeries()
+    return OwnerStatsResponse(
+        owner_address=address,
+        service_id=service_id,
+        granularity=granularity,
+        total=to_stats_bucket(series.total),
+        buckets=[
+            to_stats_bucket(bucket, start)
+            for start, bucket in series.range(granularity, since, until)
+        ],
+    )
@@ -1,9 +1,11 @@
 import asyncio
 from typing import List, Optional, TypeVar, Tuple
 
-from fastapi import APIRouter, HTTPException
-from fastapi_walletauth import WalletAuthDep
+from fastapi import APIRouter, HTTPException, Query
 
+from ...core.admission import WriteAuthDep
+from ...core.compact import compact_store
+from ...core.indexing import local, notify_listeners
 from ...core.model import (
     Service,
     Permission,
@@ -19,7 +21,10 @@ from ..api_model import (
     VoteServiceResponse,
     VoteCommentResponse,
     PutInvoiceServiceResponse,
+    RelatedService,
+    RelatedServicesResponse,
 )
+from ...core.recommendations import related_services
 from ...core.request_network import fetch_payment
 
 router = APIRouter(
@@ -69,7 +74,7 @@ async def get_services(
 
 @router.put("")
 async def upload_service(
-    service: UploadServiceRequest, wallet: WalletAuthDep
+    service: UploadServiceRequest, wallet: WriteAuthDep
 ) -> Service:
     """
     Upload a service.
@@ -92,11 +97,15 @@ async def upload_service(
             old_service.image_url = service.image_url
             old_service.tags = service.tags
             old_service.price = service.price
-            return await old_service.save()
+            await old_service.save()
+            notify_listeners(old_service)
+            return old_service
         else:
             raise HTTPException(status_code=404, detail="No Service found")
     service.owner_address = wallet.address
-    return await Service(**service.dict()).save()
+    new_service = await Service(**service.dict()).save()
+    notify_listeners(new_service)
+    return new_service
 
 
 @router.get("/{service_id}")
@@ -124,15 +133,34 @@ async def get_service_permissions(service_id: str) -> List[Permission]:
     """
     Get all granted permissions for a given service.
     """
-    permissions = await Permission.filter(service_id=service_id).all()
-    return permissions
+    permissions = local(compact_store).permissions
+    return [permissions.model(row) for row in permissions.for_service(service_id)]
+
+
+@router.get("/{service_id}/related")
+async def get_related_services(
+    service_id: str, limit: Optional[int] = Query(None, ge=1)
+) -> RelatedServicesResponse:
+    """
+    Get the services most often bought by buyers of a given service, and the services with the most similar tags.
+    """
+    also_bought, similar = local(related_services).related(service_id, limit)
+    return RelatedServicesResponse(
+        also_bought=[
+            RelatedService(service_id=other, score=score)
+            for other, score in also_bought
+        ],
+        similar=[
+            RelatedService(service_id=other, score=score) for other, score in similar
+        ],
+    )
 
 
 @router.put("/{service_id}/vote")
 async def vote_service(
     service_id: str,
     vote: VoteType,
-    wallet: WalletAuthDep,
+    wallet: WriteAuthDep,
 ) -> VoteServiceResponse:
     """
     Update your vote for a given service.
@@ -140,9 +168,7 @@ async def vote_service(
     service = await Service.fetch(service_id).first()
     if not service:
         raise HTTPException(status_code=404, detail="No Service found")
-    vote_record = await Vote.filter(
-        item_id=service_id, user_address=wallet.address
-    ).first()
+    vote_record = local(compact_store).votes.get(service_id, wallet.address)
     if not vote_record:
         vote_record = Vote(
             item_id=service_id,
@@ -160,7 +186,7 @@ async def vote_service(
 async def put_invoice_service(
     service_id: str,
     tx_hash: str,
-    wallet: WalletAuthDep,
+    wallet: WriteAuthDep,
 ) -> PutInvoiceServiceResponse:
     """
     Update your payment for a given service.
@@ -179,16 +205,20 @@ async def put_invoice_service(
             status_code=403,
             detail="payment does not match currently authorized user wallet",
         )
+    payment.service_id = service_id
     await payment.save()
     service.payment_id = payment.item_hash
     permission = Permission(
         service_id=service_id,
         user_address=wallet.address,
+        tx_hash=tx_hash,
     )
     service, permission = await asyncio.gather(
         service.save(),
         permission.save(),
     )
+    assert service is not None
+    notify_listeners(service, payment, permission)
     return PutInvoiceServiceResponse(
         service=service, permission=permission, payment=payment
     )
@@ -211,16 +241,18 @@ async def get_service_comments(
 async def post_service_comment(
     service_id: str,
     comment: str,
-    wallet: WalletAuthDep,
+    wallet: WriteAuthDep,
 ) -> Comment:
     """
     Post a comment for a given service.
     """
-    return await Comment(
+    comment_record = await Comment(
         service_id=service_id,
         comment=comment,
         user_address=wallet.address,
     ).save()
+    notify_listeners(comment_record)
+    return comment_record
 
 
 @router.put("/{service_id}/comments/{comment_id}/vote")
@@ -228,7 +260,7 @@ async def vote_service_comment(
     service_id: str,
     comment_id: str,
     vote: VoteType,
-    wallet: WalletAuthDep,
+    wallet: WriteAuthDep,
 ) -> VoteCommentResponse:
     """
     Update your vote for a given comment.
@@ -236,9 +268,7 @@ async def vote_service_comment(
     comment = await Comment.fetch(comment_id).first()
     if not comment:
         raise HTTPException(status_code=404, detail="No Comment found")
-    vote_record = await Vote.filter(
-        item_id=comment_id, user_address=wallet.address
-    ).first()
+    vote_record = local(compact_store).votes.get(comment_id, wallet.address)
     if not vote_record:
         vote_record = Vote(
             item_id=comment_id,
@@ -272,4 +302,5 @@ async def update_vote(votable: T, vote_record: Vote) -> Tuple[T, Vote]:
             vote_record.save(),
             votable.save(),
         )
+    notify_listeners(votable, vote_record)
     return votable, vote_record
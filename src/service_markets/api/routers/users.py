@@ -1,8 +1,11 @@
 from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException
-from fastapi_walletauth import WalletAuthDep
 
+from ...core.admission import WriteAuthDep
+from ...core.compact import compact_store
+from ...core.indexing import local
+from ...core.indexing import notify_listeners
 from ...core.model import Permission, UserInfo
 from ..api_model import PutUserInfo
 
@@ -31,7 +34,7 @@ async def get_users(
 
 
 @router.put("")
-async def put_user_info(user_info: PutUserInfo, wallet: WalletAuthDep) -> UserInfo:
+async def put_user_info(user_info: PutUserInfo, wallet: WriteAuthDep) -> UserInfo:
     user_record = None
     if user_info.address != wallet.address:
         raise HTTPException(
@@ -55,6 +58,7 @@ async def put_user_info(user_info: PutUserInfo, wallet: WalletAuthDep) -> UserIn
             email=user_info.email,
             link=user_info.link,
         ).save()
+    notify_listeners(user_record)
     return user_record
 
 
@@ -69,7 +73,6 @@ async def get_permissions(
     page: int = 1,
     page_size: int = 20,
 ) -> List[Permission]:
-    permission_records = await Permission.filter(user_address=address).page(
-        page=page, page_size=page_size
-    )
-    return permission_records
+    permissions = local(compact_store).permissions
+    rows = permissions.for_user(address)[(page - 1) * page_size : page * page_size]
+    return [permissions.model(row) for row in rows]
@@ -0,0 +1,17 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from ..core.reconcile import reconcile_lock
+from .routers.admin import run_reconcile
+
+
+def test_only_one_reconciliation_runs_at_a_time():
+    async def admin_request_during_a_run():
+        async with reconcile_lock:
+            with pytest.raises(HTTPException) as error:
+                await run_reconcile()
+        return error.value.status_code
+
+    assert asyncio.run(admin_request_during_a_run()) == 409
@@ -0,0 +1,61 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Dict, List
+
+from aars import AARS
+from aleph_message.models import PostMessage
+
+from ..core.generations import index_post
+from ..core.model import Service
+from ..core.shards import Shard
+from .routers.export import iter_ndjson
+
+
+def export(since=None) -> List[str]:
+    async def collect():
+        return [json.loads(line) async for line in iter_ndjson(Service, since)]
+
+    return sorted(record["item_hash"] for record in asyncio.run(collect()))
+
+
+def test_export_streams_indexed_records_and_changes_since(
+    monkeypatch, make_post, make_service_post, sharded_indices
+):
+    posts: Dict[str, PostMessage] = {}
+    for _ in range(3):
+        post = make_service_post("0xowner-export")
+        posts[post.item_hash] = post
+    old, amended, new = posts
+    changes = [
+        posts[new],
+        make_post("amend", {}, ref=amended),
+        make_post("amend", {}, ref="unknown"),
+    ]
+    queries = []
+
+    async def get_messages(**kwargs):
+        queries.append(kwargs)
+        return SimpleNamespace(
+            messages=changes,
+            pagination_per_page=kwargs["pagination"],
+            pagination_total=len(changes),
+        )
+
+    async def fetch_records(record_type, item_hashes, page_size):
+        assert len(item_hashes) <= page_size
+        for item_hash in item_hashes:
+            yield await record_type.from_post(posts[item_hash])
+
+    monkeypatch.setattr(AARS, "channel", "SERVICE_MARKETS_TEST", raising=False)
+    monkeypatch.setattr(
+        AARS, "session", SimpleNamespace(get_messages=get_messages), raising=False
+    )
+    monkeypatch.setattr(AARS, "fetch_records", fetch_records)
+
+    with Shard("SERVICE_MARKETS_EXPORT").entered():
+        for post in posts.values():
+            asyncio.run(index_post(post))
+        assert export() == sorted(posts)
+        assert export(since=123.0) == sorted([amended, new])
+    assert queries[0]["start_date"] == 123.0
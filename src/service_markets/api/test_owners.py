@@ -0,0 +1,57 @@
+import asyncio
+
+from ..conftest import random_hash
+from ..core.indexing import notify_listeners
+from ..core.model import Permission
+from ..core.sales_stats import Granularity
+from ..core.shards import Shard
+from .routers.owners import get_owner_stats
+
+HOUR = 3600
+DAY = 24 * HOUR
+# midnight UTC
+START = 1699920000.0
+
+
+def test_owner_stats_are_bucketed_and_limited_to_a_range(make_service):
+    service = make_service("0xowner-stats")
+    assert service.item_hash is not None
+    sales = [START + 10, START + 20, START + HOUR + 10, START + DAY + 10]
+
+    with Shard("SERVICE_MARKETS_OWNER_STATS").entered():
+        notify_listeners(service)
+        for timestamp in sales:
+            notify_listeners(
+                Permission(
+                    item_hash=random_hash(),
+                    user_address="0xbuyer",
+                    service_id=service.item_hash,
+                    timestamp=timestamp,
+                )
+            )
+
+        def stats(granularity: Granularity, since=None, until=None):
+            response = asyncio.run(
+                get_owner_stats(
+                    "0xowner-stats",
+                    granularity=granularity,
+                    since=since,
+                    until=until,
+                )
+            )
+            assert response.total.sales == 4
+            assert response.total.unique_buyers == 1
+            return [(bucket.start, bucket.sales) for bucket in response.buckets]
+
+        assert stats(Granularity.HOUR) == [
+            (START, 2),
+            (START + HOUR, 1),
+            (START + DAY, 1),
+        ]
+        assert stats(Granularity.DAY) == [(START, 3), (START + DAY, 1)]
+        # buckets overlapping the range are included
+        assert stats(Granularity.HOUR, since=START + 30, until=START + HOUR) == [
+            (START, 2),
+            (START + HOUR, 1),
+        ]
+        assert stats(Granularity.DAY, since=START + DAY) == [(START + DAY, 1)]
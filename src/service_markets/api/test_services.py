@@ -0,0 +1,16 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from .routers import services
+
+
+def test_related_services_limit_must_be_positive():
+    app = FastAPI()
+    app.include_router(services.router)
+    client = TestClient(app)
+
+    assert client.get("/services/unknown/related?limit=-1").status_code == 422
+    assert client.get("/services/unknown/related?limit=0").status_code == 422
+    response = client.get("/services/unknown/related?limit=1")
+    assert response.status_code == 200
+    assert response.json() == {"also_bought": [], "similar": []}
@@ -0,0 +1,127 @@
+import hashlib
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+from aars import Record
+from aleph_message.models import PostMessage
+
+from .api import api_model  # noqa: F401, declares the AARS indices
+from .core.indexing import IndexListener, listeners
+from .core.model import Service
+from .core.shards import shard_manager
+
+
+def random_hash() -> str:
+    return hashlib.sha256(uuid.uuid4().bytes).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def offline_revisions(monkeypatch):
+    """
+    Records built from posts look up their revisions on Aleph; treat every record as having one.
+    """
+
+    async def update_revision_hashes(self):
+        self.revision_hashes = [self.item_hash]
+        return self
+
+    monkeypatch.setattr(Record, "update_revision_hashes", update_revision_hashes)
+
+
+@pytest.fixture
+def make_post() -> Callable[..., PostMessage]:
+    def make(
+        post_type: str,
+        content: dict,
+        ref: Optional[str] = None,
+        channel: str = "SERVICE_MARKETS_TEST",
+    ) -> PostMessage:
+        return PostMessage.parse_obj(
+            {
+                "chain": "ETH",
+                "sender": "0x" + random_hash()[:40],
+                "type": "POST",
+                "channel": channel,
+                "time": time.time(),
+                "item_type": "storage",
+                "item_hash": random_hash(),
+                "content": {
+                    "address": "0x" + random_hash()[:40],
+                    "time": time.time(),
+                    "type": post_type,
+                    "content": content,
+                    "ref": ref,
+                },
+            }
+        )
+
+    return make
+
+
+@pytest.fixture
+def make_service_post(make_post) -> Callable[..., PostMessage]:
+    def make(owner_address: str, **kwargs) -> PostMessage:
+        content = {
+            "name": "Service",
+            "description": "A service",
+            "url": "https://example.com",
+            "price": 1.0,
+            "tags": ["test"],
+            "owner_address": owner_address,
+        }
+        return make_post("Service", content, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def make_service() -> Callable[..., Service]:
+    def make(owner_address: str = "0xowner", **kwargs) -> Service:
+        fields: Dict[str, Any] = {
+            "item_hash": random_hash(),
+            "name": "Service",
+            "description": "A service",
+            "url": "https://example.com",
+            "image_url": None,
+            "price": 1.0,
+            "tags": [],
+            "owner_address": owner_address,
+        }
+        fields.update(kwargs)
+        return Service(**fields)
+
+    return make
+
+
+@pytest.fixture
+def sharded_indices():
+    """
+    Make the AARS indices channel-aware for the duration of a test.
+    """
+    shard_manager.install()
+    yield
+    shard_manager.uninstall()
+
+
+class RecordingListener(IndexListener):
+    record_types = (Service,)
+    rebuildable = False
+
+    def __init__(self):
+        self.records: List[Record] = []
+
+    def add_record(self, record: Record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records = []
+
+
+@pytest.fixture
+def recording_listener():
+    listener = RecordingListener()
+    listeners.append(listener)
+    yield listener
+    listeners.remove(listener)
@@ -0,0 +1,188 @@
+# Desc: Admission control for endpoints that post messages to Aleph.
+# Every write is posted under the single API account, so each wallet is rate limited per route
+# with a token bucket, and the number of concurrently processed writes is capped globally.
+# Requests beyond the cap wait in a bounded queue; once the queue is full they are rejected with a 429.
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import Annotated, AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException
+from fastapi_walletauth import WalletAuth, WalletAuthDep
+from starlette.requests import Request
+
+WRITE_RATE_LIMIT_BURST = int(getenv("WRITE_RATE_LIMIT_BURST", 10))
+WRITE_RATE_LIMIT_PER_MINUTE = float(getenv("WRITE_RATE_LIMIT_PER_MINUTE", 30))
+WRITE_RATE_LIMIT_MAX_KEYS = int(getenv("WRITE_RATE_LIMIT_MAX_KEYS", 100_000))
+WRITE_MAX_IN_FLIGHT = int(getenv("WRITE_MAX_IN_FLIGHT", 16))
+WRITE_MAX_QUEUED = int(getenv("WRITE_MAX_QUEUED", 64))
+WRITE_QUEUE_TIMEOUT = float(getenv("WRITE_QUEUE_TIMEOUT", 10))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, capacity: float, refill_rate: float, now: float) -> bool:
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * refill_rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by wallet address and route.
+    Buckets are kept in LRU order and the least recently used ones are dropped beyond `max_keys`.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, max_keys: int):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self.accepted: Counter = Counter()
+        self.rejected: Counter = Counter()
+
+    def allow(self, address: str, route: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        key = (address, route)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.capacity, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        if bucket.take(self.capacity, self.refill_rate, now):
+            self.accepted[route] += 1
+            return True
+        self.rejected[route] += 1
+        return False
+
+    def retry_after(self) -> Optional[int]:
+        """
+        Seconds until an exhausted bucket has a token again, None if buckets are never refilled.
+        """
+        if self.refill_rate <= 0:
+            return None
+        return int(1 / self.refill_rate) + 1
+
+    def stats(self) -> Dict:
+        return {
+            "burst": self.capacity,
+            "per_minute": self.refill_rate * 60,
+            "tracked_keys": len(self.buckets),
+            "accepted": dict(self.accepted),
+            "rejected": dict(self.rejected),
+        }
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class WriteGate:
+    """
+    Caps the number of write requests being processed at once.
+    At most `max_queued` requests wait for a free slot, for at most `queue_timeout` seconds.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self.semaphore.locked():
+            if self.queued >= self.max_queued:
+                self.rejected_queue_full += 1
+                raise WriteQueueFull()
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise WriteQueueFull()
+            finally:
+                self.queued -= 1
+        else:
+            await self.semaphore.acquire()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it is bound to the event loop serving the requests
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+
+rate_limiter = RateLimiter(
+    capacity=WRITE_RATE_LIMIT_BURST,
+    refill_rate=WRITE_RATE_LIMIT_PER_MINUTE / 60,
+    max_keys=WRITE_RATE_LIMIT_MAX_KEYS,
+)
+write_gate = WriteGate(
+    max_in_flight=WRITE_MAX_IN_FLIGHT,
+    max_queued=WRITE_MAX_QUEUED,
+    queue_timeout=WRITE_QUEUE_TIMEOUT,
+)
+
+
+async def admit_write(
+    request: Request, wallet: WalletAuthDep
+) -> AsyncIterator[WalletAuth]:
+    """
+    FastAPI dependency for write endpoints: authenticates the wallet, applies its rate limit for
+    the current route and holds a write slot until the endpoint has returned.
+    """
+    route = request.scope.get("route")
+    route_key = f"{request.method} {route.path if route else request.url.path}"
+    if not rate_limiter.allow(wallet.address, route_key):
+        retry_after = rate_limiter.retry_after()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(retry_after)} if retry_after else None,
+        )
+    try:
+        async with write_gate.slot():
+            yield wallet
+    except WriteQueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent writes, please retry later",
+            headers={"Retry-After": "1"},
+        )
+
+
+WriteAuthDep = Annotated[WalletAuth, Depends(admit_write)]
@@ -0,0 +1,359 @@
+# Desc: Resilient wrapper around the AuthenticatedAlephClient used by AARS.
+# All calls get a deadline (carried over from the incoming HTTP request if there is one) and share a
+# concurrency limit. Reads are retried with jittered backoff and hedged to an alternate API host when
+# the primary is slow, and a circuit breaker per host fails fast while the node is unhealthy.
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+from aleph.sdk.client import AuthenticatedAlephClient
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+ALEPH_REQUEST_TIMEOUT = float(getenv("ALEPH_REQUEST_TIMEOUT", 30))
+ALEPH_MIN_REQUEST_TIMEOUT = float(getenv("ALEPH_MIN_REQUEST_TIMEOUT", 5))
+ALEPH_MAX_CONCURRENCY = int(getenv("ALEPH_MAX_CONCURRENCY", 32))
+ALEPH_READ_RETRIES = int(getenv("ALEPH_READ_RETRIES", 3))
+ALEPH_RETRY_BASE_DELAY = float(getenv("ALEPH_RETRY_BASE_DELAY", 0.2))
+ALEPH_HEDGE_API_HOST = getenv("ALEPH_HEDGE_API_HOST")
+ALEPH_HEDGE_DELAY = float(getenv("ALEPH_HEDGE_DELAY", 1))
+ALEPH_BREAKER_THRESHOLD = int(getenv("ALEPH_BREAKER_THRESHOLD", 5))
+ALEPH_BREAKER_RESET_TIMEOUT = float(getenv("ALEPH_BREAKER_RESET_TIMEOUT", 30))
+
+READ_METHODS = {
+    "get_posts",
+    "get_messages",
+    "get_message",
+    "fetch_aggregate",
+    "fetch_aggregates",
+    "download_file",
+}
+WRITE_METHODS = {
+    "create_post",
+    "create_aggregate",
+    "create_store",
+    "create_program",
+    "forget",
+    "submit",
+}
+RETRYABLE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
+
+request_deadline: ContextVar[Optional[float]] = ContextVar(
+    "request_deadline", default=None
+)
+# channel that reads and writes of the current request go to instead of `AARS.channel`
+channel_override: ContextVar[Optional[str]] = ContextVar(
+    "channel_override", default=None
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def with_channel(kwargs: dict) -> dict:
+    channel = channel_override.get()
+    if channel is None:
+        return kwargs
+    if kwargs.get("channel"):
+        kwargs["channel"] = channel
+    if kwargs.get("channels"):
+        kwargs["channels"] = [channel]
+    return kwargs
+
+
+class AlephUnavailable(Exception):
+    """Raised when the Aleph API node is considered unhealthy and no alternate host is available."""
+
+
+class AlephDeadlineExceeded(Exception):
+    """Raised when the deadline of the current request expired before Aleph answered."""
+
+
+class DeadlineMiddleware:
+    """
+    Sets the deadline for all Aleph calls made while handling a request.
+    Clients may shorten it with the `X-Request-Timeout` header (in seconds), down to `min_timeout`.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        default_timeout: float = ALEPH_REQUEST_TIMEOUT,
+        min_timeout: float = ALEPH_MIN_REQUEST_TIMEOUT,
+    ):
+        self.app = app
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timeout = self.default_timeout
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout":
+                try:
+                    timeout = min(timeout, max(float(value), self.min_timeout))
+                except ValueError:
+                    pass
+                break
+        token = request_deadline.set(time.monotonic() + timeout)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `reset_timeout` seconds.
+    Afterwards a single trial call is let through, which closes the circuit again on success.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class ResilientAlephClient:
+    """
+    Drop-in replacement for the `AuthenticatedAlephClient` handed to AARS.
+    Methods that are not known reads or writes are passed through to the wrapped client.
+    """
+
+    def __init__(
+        self,
+        client: AuthenticatedAlephClient,
+        hedge_client: Optional[AuthenticatedAlephClient] = None,
+        max_concurrency: int = ALEPH_MAX_CONCURRENCY,
+        read_retries: int = ALEPH_READ_RETRIES,
+        retry_base_delay: float = ALEPH_RETRY_BASE_DELAY,
+        hedge_delay: float = ALEPH_HEDGE_DELAY,
+        default_timeout: float = ALEPH_REQUEST_TIMEOUT,
+        min_timeout: float = ALEPH_MIN_REQUEST_TIMEOUT,
+        breaker_threshold: int = ALEPH_BREAKER_THRESHOLD,
+        breaker_reset_timeout: float = ALEPH_BREAKER_RESET_TIMEOUT,
+    ):
+        self.client = client
+        self.hedge_client = hedge_client
+        self.max_concurrency = max_concurrency
+        self.read_retries = read_retries
+        self.retry_base_delay = retry_base_delay
+        self.hedge_delay = hedge_delay
+        self.default_timeout = default_timeout
+        # timeouts of calls given less time than this are blamed on the deadline, not the node
+        self.min_timeout = min(min_timeout, default_timeout)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        self.hedge_breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.counters: Dict[str, int] = {
+            "calls": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+            "rejected_open_circuit": 0,
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.client, name)
+        if name in READ_METHODS:
+            return lambda *args, **kwargs: self._read(name, args, with_channel(kwargs))
+        if name in WRITE_METHODS:
+            return lambda *args, **kwargs: self._write(name, args, with_channel(kwargs))
+        return attribute
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it is bound to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _remaining(self) -> float:
+        deadline = request_deadline.get()
+        if deadline is None:
+            return self.default_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.counters["deadline_exceeded"] += 1
+            raise AlephDeadlineExceeded()
+        return remaining
+
+    def _call_timeout(self) -> float:
+        return min(self._remaining(), self.default_timeout)
+
+    async def _attempt(
+        self,
+        client: AuthenticatedAlephClient,
+        breaker: CircuitBreaker,
+        name: str,
+        args: tuple,
+        kwargs: dict,
+    ) -> Any:
+        if not breaker.allow():
+            self.counters["rejected_open_circuit"] += 1
+            raise AlephUnavailable(f"circuit open, not calling {name}")
+        try:
+            # waiting for a free slot counts against the deadline too
+            timeout = self._call_timeout()
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            breaker.trial_running = False
+            self.counters["deadline_exceeded"] += 1
+            raise AlephDeadlineExceeded()
+        except BaseException:
+            breaker.trial_running = False
+            raise
+        self.in_flight += 1
+        try:
+            timeout = self._call_timeout()
+            self.counters["calls"] += 1
+            result = await asyncio.wait_for(
+                getattr(client, name)(*args, **kwargs), timeout
+            )
+        except asyncio.TimeoutError:
+            if timeout < self.min_timeout:
+                breaker.trial_running = False
+                self.counters["deadline_exceeded"] += 1
+                raise AlephDeadlineExceeded()
+            breaker.record_failure()
+            raise
+        except AlephDeadlineExceeded:
+            breaker.trial_running = False
+            raise
+        except asyncio.CancelledError:
+            breaker.trial_running = False
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                # the node answered, just not with what we asked for
+                breaker.record_success()
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+        breaker.record_success()
+        return result
+
+    async def _hedged(self, name: str, args: tuple, kwargs: dict) -> Any:
+        """
+        Call the primary host and, if it has not answered after `hedge_delay`, the alternate host too.
+        The first successful answer wins and the other call is cancelled.
+        """
+        if self.hedge_client is None:
+            return await self._attempt(self.client, self.breaker, name, args, kwargs)
+        if self.breaker.state == "open":
+            return await self._attempt(
+                self.hedge_client, self.hedge_breaker, name, args, kwargs
+            )
+        primary = asyncio.ensure_future(
+            self._attempt(self.client, self.breaker, name, args, kwargs)
+        )
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+        self.counters["hedges"] += 1
+        hedge = asyncio.ensure_future(
+            self._attempt(self.hedge_client, self.hedge_breaker, name, args, kwargs)
+        )
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        assert error is not None
+        raise error
+
+    async def _read(self, name: str, args: tuple, kwargs: dict) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(name, args, kwargs)
+            except Exception as e:
+                attempt += 1
+                if not is_retryable(e) or attempt > self.read_retries:
+                    raise
+            # full jitter exponential backoff, never sleeping past the deadline
+            delay = random.uniform(0, self.retry_base_delay * 2**attempt)
+            if delay >= self._remaining():
+                self.counters["deadline_exceeded"] += 1
+                raise AlephDeadlineExceeded()
+            self.counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def _write(self, name: str, args: tuple, kwargs: dict) -> Any:
+        return await self._attempt(self.client, self.breaker, name, args, kwargs)
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "primary": self.breaker.stats(),
+            "hedge": self.hedge_breaker.stats() if self.hedge_client else None,
+        }
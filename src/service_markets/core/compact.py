@@ -0,0 +1,331 @@
+# Desc: Compact in-memory storage of indexed `Permission` and `Vote` records.
+# Wallet addresses and item hashes are interned into integer ids, and the fields are kept in
+# array-backed columns. Pydantic models are only built when a record is returned.
+# The AARS indices only map field values to item hashes, so records are otherwise not held in memory at
+# all; the store is what lets the permission and vote endpoints answer without fetching from Aleph.
+import math
+import sys
+from array import array
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from aars import Record
+
+from .indexing import IndexListener, ShardedHashmap, register_listener
+from .model import Permission, VotableType, Vote, VoteType
+
+NO_ID = 0xFFFFFFFF
+# number of records built as pydantic models to estimate their size in the memory report
+MEMORY_REPORT_SAMPLE_SIZE = 100
+VOTABLE_TYPES = list(VotableType)
+VOTE_TYPES = list(VoteType)
+
+
+class Interner:
+    """
+    Maps strings to dense integer ids and back.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def intern(self, string: Optional[str]) -> int:
+        if string is None:
+            return NO_ID
+        id_ = self.ids.get(string)
+        if id_ is None:
+            id_ = self.ids[string] = len(self.strings)
+            # item hashes are `ItemHash`, a str subclass that cannot be interned as is
+            self.strings.append(sys.intern(str(string)))
+        return id_
+
+    def get(self, string: str) -> Optional[int]:
+        return self.ids.get(string)
+
+    def lookup(self, id_: int) -> Optional[str]:
+        return None if id_ == NO_ID else self.strings[id_]
+
+    def __getitem__(self, id_: int) -> str:
+        return self.strings[id_]
+
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self.ids)
+            + sys.getsizeof(self.strings)
+            + sum(sys.getsizeof(string) for string in self.strings)
+        )
+
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    seen = set() if seen is None else seen
+    # enum members are singletons shared by all records
+    if id(obj) in seen or isinstance(obj, Enum):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+def index_nbytes(index: Dict[int, array]) -> int:
+    return sys.getsizeof(index) + sum(sys.getsizeof(rows) for rows in index.values())
+
+
+class RecordColumns:
+    """
+    Columns of the fields every record has. Subclasses add the columns of their own fields.
+    """
+
+    def __init__(self, interner: Interner):
+        self.interner = interner
+        self.item_hash = array("I")
+        self.signer = array("I")
+        self.current_revision = array("I")
+        # NaN for records without a timestamp
+        self.timestamp = array("d")
+        # only for amended records, the others' sole revision is their item hash
+        self.revisions: Dict[int, array] = {}
+        self.rows: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.item_hash)
+
+    def _add_record(self, record: Record) -> Tuple[int, bool]:
+        """
+        Store the fields every record has and return its row, and whether it was stored before.
+        """
+        intern = self.interner.intern
+        item_hash = intern(record.item_hash)
+        row = self.rows.get(item_hash)
+        amended = row is not None
+        if row is not None:
+            self.signer[row] = intern(record.signer)
+            self.current_revision[row] = record.current_revision or 0
+        else:
+            row = self.rows[item_hash] = len(self.item_hash)
+            self.item_hash.append(item_hash)
+            self.signer.append(intern(record.signer))
+            self.current_revision.append(record.current_revision or 0)
+            self.timestamp.append(
+                math.nan if record.timestamp is None else record.timestamp
+            )
+        if len(record.revision_hashes) > 1:
+            self.revisions[row] = array(
+                "I", (intern(revision) for revision in record.revision_hashes)
+            )
+        return row, amended
+
+    def _record_fields(self, row: int) -> Dict[str, Any]:
+        interner = self.interner
+        item_hash = self.item_hash[row]
+        timestamp = self.timestamp[row]
+        return {
+            "item_hash": interner[item_hash],
+            "signer": interner.lookup(self.signer[row]),
+            "revision_hashes": [
+                interner[revision] for revision in self.revisions.get(row, (item_hash,))
+            ],
+            "current_revision": self.current_revision[row],
+            "timestamp": None if math.isnan(timestamp) else timestamp,
+        }
+
+    def model(self, row: int) -> Record:
+        raise NotImplementedError
+
+    def nbytes(self) -> int:
+        columns = (self.item_hash, self.signer, self.current_revision, self.timestamp)
+        return (
+            sum(sys.getsizeof(column) for column in columns)
+            + sys.getsizeof(self.rows)
+            + index_nbytes(self.revisions)
+        )
+
+
+class PermissionColumns(RecordColumns):
+    def __init__(self, interner: Interner):
+        super().__init__(interner)
+        self.user = array("I")
+        self.service = array("I")
+        self.tx_hash = array("I")
+        self.by_user: Dict[int, array] = {}
+        self.by_service: Dict[int, array] = {}
+
+    def add(self, permission: Permission):
+        intern = self.interner.intern
+        user = intern(permission.user_address)
+        service = intern(permission.service_id)
+        row, amended = self._add_record(permission)
+        if amended:
+            self._unlink(self.by_user, self.user[row], row)
+            self._unlink(self.by_service, self.service[row], row)
+            self.user[row] = user
+            self.service[row] = service
+            self.tx_hash[row] = intern(permission.tx_hash)
+        else:
+            self.user.append(user)
+            self.service.append(service)
+            self.tx_hash.append(intern(permission.tx_hash))
+        self.by_user.setdefault(user, array("I")).append(row)
+        self.by_service.setdefault(service, array("I")).append(row)
+
+    @staticmethod
+    def _unlink(index: Dict[int, array], key: int, row: int):
+        rows = index.get(key)
+        if rows is not None and row in rows:
+            rows.remove(row)
+
+    def model(self, row: int) -> Permission:
+        interner = self.interner
+        return Permission(
+            **self._record_fields(row),
+            user_address=interner[self.user[row]],
+            service_id=interner[self.service[row]],
+            tx_hash=interner.lookup(self.tx_hash[row]),
+        )
+
+    def _rows(self, index: Dict[int, array], value: str) -> array:
+        id_ = self.interner.get(value)
+        return index.get(id_, array("I")) if id_ is not None else array("I")
+
+    def for_user(self, user_address: str) -> array:
+        return self._rows(self.by_user, user_address)
+
+    def for_service(self, service_id: str) -> array:
+        return self._rows(self.by_service, service_id)
+
+    def nbytes(self) -> int:
+        columns = (self.user, self.service, self.tx_hash)
+        return (
+            super().nbytes()
+            + sum(sys.getsizeof(column) for column in columns)
+            + index_nbytes(self.by_user)
+            + index_nbytes(self.by_service)
+        )
+
+
+class VoteColumns(RecordColumns):
+    def __init__(self, interner: Interner):
+        super().__init__(interner)
+        self.item = array("I")
+        self.user = array("I")
+        self.item_type = array("B")
+        self.vote = array("B")
+        # keyed by item id << 32 | user id
+        self.by_item_user: Dict[int, int] = {}
+
+    def add(self, vote: Vote):
+        intern = self.interner.intern
+        item = intern(vote.item_id)
+        user = intern(vote.user_address)
+        row, amended = self._add_record(vote)
+        if amended:
+            old_key = self.item[row] << 32 | self.user[row]
+            if self.by_item_user.get(old_key) == row:
+                del self.by_item_user[old_key]
+            self.item[row] = item
+            self.user[row] = user
+            self.item_type[row] = VOTABLE_TYPES.index(vote.item_type)
+            self.vote[row] = VOTE_TYPES.index(vote.vote)
+        else:
+            self.item.append(item)
+            self.user.append(user)
+            self.item_type.append(VOTABLE_TYPES.index(vote.item_type))
+            self.vote.append(VOTE_TYPES.index(vote.vote))
+        self.by_item_user[item << 32 | user] = row
+
+    def model(self, row: int) -> Vote:
+        interner = self.interner
+        return Vote(
+            **self._record_fields(row),
+            item_id=interner[self.item[row]],
+            item_type=VOTABLE_TYPES[self.item_type[row]],
+            user_address=interner[self.user[row]],
+            vote=VOTE_TYPES[self.vote[row]],
+        )
+
+    def get(self, item_id: str, user_address: str) -> Optional[Vote]:
+        """
+        Get the vote of a user for a service or comment.
+        """
+        item = self.interner.get(item_id)
+        user = self.interner.get(user_address)
+        if item is None or user is None:
+            return None
+        row = self.by_item_user.get(item << 32 | user)
+        return None if row is None else self.model(row)
+
+    def nbytes(self) -> int:
+        columns = (self.item, self.user, self.item_type, self.vote)
+        return (
+            super().nbytes()
+            + sum(sys.getsizeof(column) for column in columns)
+            + sys.getsizeof(self.by_item_user)
+        )
+
+
+class CompactStore(IndexListener):
+    record_types = (Permission, Vote)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.interner = Interner()
+        self.permissions = PermissionColumns(self.interner)
+        self.votes = VoteColumns(self.interner)
+
+    def add_record(self, record: Record):
+        if isinstance(record, Permission):
+            self.permissions.add(record)
+        elif isinstance(record, Vote):
+            self.votes.add(record)
+
+    def memory_report(self) -> Dict[str, Any]:
+        """
+        Compare, per record type, the bytes per record of the compact columns with those of the records as
+        pydantic models, estimated from a sample, and report the bytes of the AARS index hashmaps. Interned
+        strings are shared by all record types and reported separately.
+        """
+        report: Dict[str, Any] = {
+            "interned_strings": len(self.interner),
+            "interner_bytes": self.interner.nbytes(),
+        }
+        record_columns: Tuple[Tuple[Type[Record], RecordColumns], ...] = (
+            (Permission, self.permissions),
+            (Vote, self.votes),
+        )
+        for record_type, columns in record_columns:
+            count = len(columns)
+            sample = [
+                columns.model(row)
+                for row in range(min(count, MEMORY_REPORT_SAMPLE_SIZE))
+            ]
+            index_bytes = 0
+            for index in record_type.get_indices():
+                hashmap = index.hashmap
+                if isinstance(hashmap, ShardedHashmap):
+                    hashmap = hashmap.current()
+                index_bytes += deep_sizeof(hashmap)
+            report[record_type.__name__] = {
+                "records": count,
+                "model_bytes_per_record": (
+                    sum(deep_sizeof(model) for model in sample) / len(sample)
+                    if sample
+                    else 0
+                ),
+                "compact_bytes_per_record": columns.nbytes() / count if count else 0,
+                "index_bytes": index_bytes,
+            }
+        return report
+
+
+compact_store = register_listener(CompactStore())
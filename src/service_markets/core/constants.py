@@ -18,6 +18,7 @@ API_MESSAGE_FILTER = [
             "Vote",
             "Comment",
             "Permission",
+            "Payment",
             "amend",
         ],
     }
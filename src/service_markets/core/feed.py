@@ -0,0 +1,169 @@
+# Desc: Push feed of marketplace changes.
+# Every indexed record is turned into a compact change event and fanned out to the subscribers whose
+# filters match. Each subscriber has a bounded buffer; subscribers that do not keep up are evicted
+# instead of letting their buffer grow.
+import asyncio
+from os import getenv
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from aars import Record
+
+from .indexing import IndexListener, local, register_listener
+from .model import Comment, Payment, Permission, Service, UserInfo, VotableType, Vote
+from .sales_stats import sales_stats
+
+FEED_BUFFER_SIZE = int(getenv("FEED_BUFFER_SIZE", 100))
+FEED_MAX_SUBSCRIBERS = int(getenv("FEED_MAX_SUBSCRIBERS", 1000))
+
+COMPACT_FIELDS: Dict[Type[Record], Tuple[str, ...]] = {
+    Service: ("name", "owner_address", "upvotes", "downvotes", "comment_counter"),
+    Comment: ("service_id", "user_address", "upvotes", "downvotes"),
+    Vote: ("item_id", "item_type", "user_address", "vote"),
+    Permission: ("service_id", "user_address"),
+    Payment: ("service_id",),
+    UserInfo: ("address", "username"),
+}
+
+
+class CommentServices(IndexListener):
+    """
+    Resolves the services of comments, for votes on comments to reach the subscribers of their service.
+    """
+
+    record_types = (Comment,)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.services: Dict[str, str] = {}
+
+    def add_record(self, record: Record):
+        assert isinstance(record, Comment) and record.item_hash is not None
+        self.services[record.item_hash] = record.service_id
+
+
+comment_services = register_listener(CommentServices())
+
+
+def event_service_id(record: Record) -> Optional[str]:
+    if isinstance(record, Service):
+        return record.item_hash
+    if isinstance(record, Vote):
+        if record.item_type == VotableType.COMMENT:
+            return local(comment_services).services.get(record.item_id)
+        return record.item_id
+    return getattr(record, "service_id", None)
+
+
+def to_change_event(record: Record, service_id: Optional[str]) -> Dict[str, Any]:
+    event = {
+        "type": type(record).__name__,
+        "item_hash": record.item_hash,
+        "revision": record.current_revision,
+    }
+    for field in COMPACT_FIELDS[type(record)]:
+        event[field] = getattr(record, field)
+    if isinstance(record, Vote):
+        event["service_id"] = service_id
+    return event
+
+
+class FeedSubscriber:
+    def __init__(
+        self,
+        service_ids: Set[str],
+        record_types: Set[str],
+        owners: Set[str],
+        buffer_size: int,
+    ):
+        self.service_ids = service_ids
+        self.record_types = record_types
+        self.owners = owners
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.evicted = False
+
+    def matches(
+        self, record_type: str, service_id: Optional[str], owner: Optional[str]
+    ) -> bool:
+        if self.record_types and record_type not in self.record_types:
+            return False
+        if self.service_ids and service_id not in self.service_ids:
+            return False
+        if self.owners and owner not in self.owners:
+            return False
+        return True
+
+
+class FeedFull(Exception):
+    pass
+
+
+class ChangeFeed(IndexListener):
+    record_types = tuple(COMPACT_FIELDS)
+    # replaying the whole channel to live subscribers on a re-index would only flood them
+    rebuildable = False
+
+    def __init__(self, buffer_size: int, max_subscribers: int):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.subscribers: List[FeedSubscriber] = []
+        self.published = 0
+        self.evicted = 0
+
+    def subscribe(
+        self,
+        service_ids: Set[str],
+        record_types: Set[str],
+        owners: Set[str],
+    ) -> FeedSubscriber:
+        if len(self.subscribers) >= self.max_subscribers:
+            raise FeedFull()
+        subscriber = FeedSubscriber(service_ids, record_types, owners, self.buffer_size)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: FeedSubscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def add_record(self, record: Record):
+        if not self.subscribers:
+            return
+        service_id = event_service_id(record)
+        event = to_change_event(record, service_id)
+        owner: Optional[str] = None
+        if isinstance(record, Service):
+            owner = record.owner_address
+        elif service_id is not None:
+            owner = local(sales_stats).service_owners.get(service_id)
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            if not subscriber.matches(event["type"], service_id, owner):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.evicted = True
+                self.evicted += 1
+                self.unsubscribe(subscriber)
+
+    def clear(self):
+        pass
+
+    def fork(self) -> "ChangeFeed":
+        return ChangeFeed(self.buffer_size, self.max_subscribers)
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "max_subscribers": self.max_subscribers,
+            "buffer_size": self.buffer_size,
+            "published": self.published,
+            "evicted": self.evicted,
+        }
+
+
+change_feed = register_listener(
+    ChangeFeed(buffer_size=FEED_BUFFER_SIZE, max_subscribers=FEED_MAX_SUBSCRIBERS)
+)
@@ -0,0 +1,200 @@
+# Desc: Generation-based re-indexing.
+# A new generation of the AARS indices and of all rebuildable listeners is built off to the side
+# while the current generation keeps serving. Records indexed in the meantime are buffered and
+# replayed into the new generation, which then replaces the current one in a single step.
+import asyncio
+import time
+from enum import Enum
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Type
+
+from aars import Index, Record
+from aleph_message.models import PostMessage
+
+from .aleph_client import request_deadline
+from .indexing import (
+    IndexListener,
+    feed_listener,
+    listeners,
+    local,
+    mark_indexed,
+    notify_listeners,
+    register_listener,
+    replace_hashmap,
+)
+from .model import Comment, Payment, Permission, Service, UserInfo, Vote
+
+IndexPair = Tuple[Type[Record], Index, Index]
+ListenerPair = Tuple[IndexListener, IndexListener]
+
+
+class ReindexState(str, Enum):
+    IDLE = "idle"
+    BUILDING = "building"
+    FAILED = "failed"
+
+
+class IndexGenerationManager(IndexListener):
+    """
+    Registered as a listener itself, so that it sees every record indexed during a rebuild.
+    """
+
+    rebuildable = False
+
+    def __init__(self, record_types: Sequence[Type[Record]] = ()):
+        self.record_types = tuple(record_types)
+        self.generation = 0
+        self.state = ReindexState.IDLE
+        self.progress: Dict[str, int] = {}
+        self.buffered: List[Record] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def building(self) -> bool:
+        return self.state == ReindexState.BUILDING
+
+    def add_record(self, record: Record):
+        if self.building:
+            self.buffered.append(record)
+
+    def clear(self):
+        pass
+
+    def fork(self) -> "IndexGenerationManager":
+        return IndexGenerationManager(self.record_types)
+
+    def start(self) -> bool:
+        """
+        Start rebuilding in the background. Returns False if a rebuild is already running.
+        """
+        if self.building:
+            return False
+        task = asyncio.ensure_future(self.rebuild())
+        task.add_done_callback(self._report_failure)
+        self.task = task
+        return True
+
+    @staticmethod
+    def _report_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"Re-indexing failed: {task.exception()!r}")
+
+    async def rebuild(self):
+        # started from within a request, whose deadline a rebuild would not meet
+        request_deadline.set(None)
+        self.state = ReindexState.BUILDING
+        self.progress = {record_type.__name__: 0 for record_type in self.record_types}
+        self.buffered = []
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = None
+        try:
+            indices, next_listeners, item_hashes = await self._build()
+        except Exception as e:
+            self.state = ReindexState.FAILED
+            self.error = repr(e)
+            self.buffered = []
+            raise
+        self._swap(indices, next_listeners, item_hashes)
+
+    @staticmethod
+    def _scratch_listeners() -> List[ListenerPair]:
+        pairs = []
+        for listener in listeners:
+            if listener.rebuildable:
+                instance = local(listener)
+                pairs.append((instance, instance.fork()))
+        return pairs
+
+    async def _build(self) -> Tuple[List[IndexPair], List[ListenerPair], Set[str]]:
+        indices: List[IndexPair] = []
+        next_listeners = self._scratch_listeners()
+        item_hashes: Set[str] = set()
+        for record_type in self.record_types:
+            type_indices = []
+            for index in record_type.get_indices():
+                # not copy.copy, which shares the `__dict__` of pydantic models
+                scratch = index.copy(update={"hashmap": {}})
+                type_indices.append(scratch)
+                indices.append((record_type, index, scratch))
+            type_listeners = [
+                fork
+                for _, fork in next_listeners
+                if issubclass(record_type, fork.record_types)
+            ]
+            async for record in record_type.fetch_objects():
+                assert record.item_hash is not None
+                for scratch in type_indices:
+                    scratch.add_record(record)
+                for fork in type_listeners:
+                    feed_listener(fork, record)
+                item_hashes.add(record.item_hash)
+                self.progress[record_type.__name__] += 1
+        return indices, next_listeners, item_hashes
+
+    def _swap(
+        self,
+        indices: List[IndexPair],
+        next_listeners: List[ListenerPair],
+        item_hashes: Set[str],
+    ):
+        # no awaits from here on: requests see either the old or the new generation, never a mix
+        for record in self.buffered:
+            for record_type, _, scratch in indices:
+                if isinstance(record, record_type):
+                    scratch.add_record(record)
+            for _, fork in next_listeners:
+                if isinstance(record, fork.record_types):
+                    feed_listener(fork, record)
+        for _, index, scratch in indices:
+            replace_hashmap(index, scratch.hashmap)
+        for listener, fork in next_listeners:
+            listener.__dict__.update(fork.__dict__)
+        # lets `index_post` skip messages of these records, as `AARS.sync_indices` would
+        mark_indexed(item_hashes)
+        self.generation += 1
+        self.buffered = []
+        self.state = ReindexState.IDLE
+        self.finished_at = time.time()
+
+    def stats(self) -> Dict:
+        return {
+            "generation": self.generation,
+            "state": self.state,
+            "progress": self.progress,
+            "buffered": len(self.buffered),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+# services come first, so that listeners can resolve the owners of everything indexed after them
+index_manager = register_listener(
+    IndexGenerationManager(
+        record_types=(Service, UserInfo, Vote, Comment, Permission, Payment)
+    )
+)
+
+
+async def index_post(event: PostMessage):
+    """
+    Index a record posted to the channel of the current request, unless it is indexed already.
+    """
+    record: Optional[Record]
+    record_types = {
+        record_type.__name__: record_type for record_type in index_manager.record_types
+    }
+    if event.content.type in record_types:
+        if Record.is_indexed(event.item_hash):
+            return
+        record = await record_types[event.content.type].from_post(event)
+    else:  # amend
+        if Record.is_indexed(event.content.ref):
+            return
+        record = await Record.fetch(event.content.ref).first()
+    assert record
+    record._index()
+    notify_listeners(record)
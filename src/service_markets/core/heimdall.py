@@ -2,21 +2,32 @@
 # It will raise a 403 if the user is not allowed to access the endpoint.
 # For the first request, the Aleph network will be queried to see if the user is allowed to access the endpoint.
 import asyncio
-from typing import Optional, List
+from typing import Dict, Iterable, List, Optional, Type, Union
 
-from aars import AARS, Index
+from aars import AARS, Index, Record
 from fastapi import HTTPException, FastAPI
 from fastapi_walletauth import WalletAuth, authorization_routes
 from fastapi_walletauth.core import SignatureChallengeTokenAuth
 from starlette.requests import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from .model import Permission, Service
 from .session import initialize_aars
 
 
-Index(Service, "url")
-Index(Permission, ["user_address", "service_id"])
+def declare_index(record_type: Type[Record], on: Union[str, List[str]]):
+    """
+    Declare an index, unless the service.markets API module declaring the same is loaded in this process.
+    """
+    try:
+        Index(record_type, on)
+    except ValueError:
+        pass
+
+
+declare_index(Service, "url")
+declare_index(Permission, ["user_address", "service_id"])
 
 
 class ServicePermissionAuth(SignatureChallengeTokenAuth):
@@ -32,20 +43,17 @@ class ServicePermissionAuth(SignatureChallengeTokenAuth):
         super().__init__()
         self.service_url = service_url
 
-    def __call__(self, request: Request) -> WalletAuth:
+    async def __call__(self, request: Request) -> WalletAuth:
         """
         Check if the user has the given permission for the given service.
         """
         wallet_auth: WalletAuth = super().__call__(request)
         if self.cached_permissions.get(wallet_auth.address):
             return wallet_auth
-        loop = self.aars.session.http_session.loop
-        permission_record = loop.run_until_complete(
-            Permission.filter(
-                user_address=wallet_auth.address,
-                service_id=self.service_record.item_hash,
-            ).all()
-        )
+        permission_record = await Permission.filter(
+            user_address=wallet_auth.address,
+            service_id=self.service_record.item_hash,
+        ).all()
         if not permission_record:
             raise HTTPException(
                 status_code=403,
@@ -69,30 +77,105 @@ class ServicePermissionAuth(SignatureChallengeTokenAuth):
         self.ready = True
 
 
-class HeimdallMiddleware(BaseHTTPMiddleware):
+class PrefixTrie:
+    """
+    Character trie answering whether a path starts with any of the given prefixes.
+    """
+
+    END = ""
+
+    def __init__(self, prefixes: Iterable[str]):
+        self.root: Dict[str, dict] = {}
+        for prefix in prefixes:
+            node = self.root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self.END] = {}
+
+    def matches(self, path: str) -> bool:
+        node = self.root
+        if self.END in node:
+            return True
+        for char in path:
+            child = node.get(char)
+            if child is None:
+                return False
+            if self.END in child:
+                return True
+            node = child
+        return False
+
+
+class RouteTable:
+    """
+    Decides whether a path is open (starts with an open route or equals an open endpoint) or protected.
+    Decisions are cached per path; the cache is reset once it holds `cache_size` paths.
+    """
+
+    def __init__(
+        self,
+        open_routes: Iterable[str],
+        open_endpoints: Iterable[str],
+        cache_size: int = 4096,
+    ):
+        self.open_routes = PrefixTrie(open_routes)
+        self.open_endpoints = frozenset(open_endpoints)
+        self.cache_size = cache_size
+        self.cache: Dict[str, bool] = {}
+
+    def is_open(self, path: str) -> bool:
+        decision = self.cache.get(path)
+        if decision is None:
+            decision = path in self.open_endpoints or self.open_routes.matches(path)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[path] = decision
+        return decision
+
+
+class HeimdallMiddleware:
+    """
+    Pure ASGI middleware: open paths are passed through untouched, protected paths require a wallet
+    with a permission for the service. For those, `scope["heimdall_protected"]` is set and the
+    resolved `WalletAuth` is available as `request.state.wallet_auth`.
+    """
+
     def __init__(
         self,
-        app: FastAPI,
+        app: ASGIApp,
         backend: ServicePermissionAuth,
         open_routes: List[str],
         open_endpoints: List[str],
         **kwargs,
     ):
-        super().__init__(app)
+        self.app = app
         self.backend = backend
-        self.open_routes = open_routes
-        self.open_endpoints = open_endpoints
+        self.routes = RouteTable(open_routes, open_endpoints)
         self.kwargs = kwargs
+        self.setup_lock: Optional[asyncio.Lock] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.routes.is_open(scope["path"]):
+            return await self.app(scope, receive, send)
+        try:
+            if not self.backend.ready:
+                await self.setup_backend()
+            wallet_auth = await self.backend(Request(scope))
+        except HTTPException as e:
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers=e.headers
+            )
+            return await response(scope, receive, send)
+        scope["heimdall_protected"] = True
+        scope.setdefault("state", {})["wallet_auth"] = wallet_auth
+        await self.app(scope, receive, send)
 
-    async def dispatch(self, request, call_next):
-        if (
-            not any([request.url.path.startswith(route) for route in self.open_routes])
-            and not any([not request.url.path == endpoint for endpoint in self.open_endpoints])
-        ):
+    async def setup_backend(self):
+        if self.setup_lock is None:
+            self.setup_lock = asyncio.Lock()
+        async with self.setup_lock:
             if not self.backend.ready:
                 await self.backend.setup(**self.kwargs)
-            request.state.wallet_auth = self.backend(request)
-        return await call_next(request)
 
 
 def setup_heimdall(app: FastAPI, service_url: str, **kwargs):
@@ -100,23 +183,15 @@ def setup_heimdall(app: FastAPI, service_url: str, **kwargs):
     Setup Heimdall middleware for the given app. This will check if the user has permission to access the given service.
     Permission is checked by querying the Aleph network.
     """
-    if kwargs["open_routes"]:
-        open_routes = kwargs["open_routes"]
-        del kwargs["open_routes"]
-    else:
-        open_routes = [
-            "/authorization",
-            "/docs",
-            "/openapi.json",
-            "/redoc",
-        ]
-    if kwargs["open_endpoints"]:
-        open_endpoints = kwargs["open_endpoints"]
-        del kwargs["open_endpoints"]
-    else:
-        open_endpoints = [
-            "/",
-        ]
+    open_routes = kwargs.pop("open_routes", None) or [
+        "/authorization",
+        "/docs",
+        "/openapi.json",
+        "/redoc",
+    ]
+    open_endpoints = kwargs.pop("open_endpoints", None) or [
+        "/",
+    ]
     app.add_middleware(
         HeimdallMiddleware,
         backend=ServicePermissionAuth(service_url),
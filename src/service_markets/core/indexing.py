@@ -0,0 +1,197 @@
+# Desc: Hooks for in-memory structures that are maintained alongside the AARS indices.
+# Listeners are notified of every record that gets indexed, be it through the message listener
+# (`fishnet_event`) or a write handler of this API.
+# When serving several channels (see `shards.py`), each channel has its own index hashmaps and its own
+# instance of every listener; `local` resolves the instance of the channel the current request is for.
+import copy
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Type, TypeVar
+
+from aars import Index, Record
+
+
+class IndexListener:
+    """
+    On a re-index, rebuildable listeners are forked to build the next generation off to the side.
+    The default `fork` is a shallow copy followed by `clear`, so `clear` must assign fresh containers
+    rather than emptying the existing ones.
+    """
+
+    record_types: Tuple[Type[Record], ...] = ()
+    # whether the listener is cleared and fed all records again on a re-index
+    rebuildable: bool = True
+
+    def add_record(self, record: Record):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def fork(self) -> "IndexListener":
+        """
+        Return an empty listener configured like this one.
+        """
+        fresh = copy.copy(self)
+        fresh.clear()
+        return fresh
+
+
+L = TypeVar("L", bound=IndexListener)
+
+listeners: List[IndexListener] = []
+
+
+class ShardState:
+    """
+    Index hashmaps and listener instances of one channel, other than the default one.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.hashmaps: Dict[int, dict] = {}
+        self.listeners: Dict[int, IndexListener] = {}
+
+
+current_shard: ContextVar[Optional[ShardState]] = ContextVar(
+    "current_shard", default=None
+)
+
+
+def local(listener: L) -> L:
+    """
+    Get the instance of a registered listener for the channel of the current request.
+    """
+    shard = current_shard.get()
+    if shard is None:
+        return listener
+    instance = shard.listeners.get(id(listener))
+    if instance is None:
+        instance = shard.listeners[id(listener)] = listener.fork()
+    return instance  # type: ignore
+
+
+def register_listener(listener: L) -> L:
+    listeners.append(listener)
+    return listener
+
+
+def feed_listener(listener: IndexListener, record: Record):
+    """
+    Add a record to a listener. A record the listener fails on is skipped, instead of failing the write or
+    re-index that indexed it.
+    """
+    try:
+        listener.add_record(record)
+    except Exception as e:
+        print(f"{type(listener).__name__} failed to add {record!r}: {e!r}")
+
+
+def notify_listeners(*records: Record):
+    """
+    Notify all interested listeners of newly indexed (or amended) records.
+    """
+    for record in records:
+        for listener in listeners:
+            if isinstance(record, listener.record_types):
+                feed_listener(local(listener), record)
+
+
+class ShardedHashmap(dict):
+    """
+    Stands in for the hashmap of an AARS index and delegates to the hashmap of the current channel.
+    """
+
+    def __init__(self, default: dict):
+        super().__init__()
+        self.key = id(self)
+        self.default = default
+
+    def current(self) -> dict:
+        shard = current_shard.get()
+        if shard is None:
+            return self.default
+        hashmap = shard.hashmaps.get(self.key)
+        if hashmap is None:
+            hashmap = shard.hashmaps[self.key] = {}
+        return hashmap
+
+    def replace(self, hashmap: dict):
+        shard = current_shard.get()
+        if shard is None:
+            self.default = hashmap
+        else:
+            shard.hashmaps[self.key] = hashmap
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __setitem__(self, key, value):
+        self.current()[key] = value
+
+    def __delitem__(self, key):
+        del self.current()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.current()
+
+    def __iter__(self) -> Iterator:
+        return iter(self.current())
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+    def __bool__(self) -> bool:
+        return bool(self.current())
+
+    def get(self, key, default=None):
+        return self.current().get(key, default)
+
+    def setdefault(self, key, default=None):
+        return self.current().setdefault(key, default)
+
+    def pop(self, key, *args):
+        return self.current().pop(key, *args)
+
+    def keys(self):
+        return self.current().keys()
+
+    def values(self):
+        return self.current().values()
+
+    def items(self):
+        return self.current().items()
+
+
+def mark_indexed(item_hashes: Iterable[str]):
+    """
+    Register records as indexed for `Record.is_indexed`, like `Record._index` does for a single one.
+    """
+    Record._Record__indexed_items.update(item_hashes)  # type: ignore
+
+
+def set_hashmap(index: Index, hashmap: dict):
+    """
+    Set the hashmap of an index as is. Assigning it would be validated by pydantic, which copies it into a
+    plain dict.
+    """
+    index.__dict__["hashmap"] = hashmap
+
+
+def shard_index(index: Index):
+    if not isinstance(index.hashmap, ShardedHashmap):
+        set_hashmap(index, ShardedHashmap(index.hashmap))
+
+
+def unshard_index(index: Index):
+    if isinstance(index.hashmap, ShardedHashmap):
+        set_hashmap(index, index.hashmap.default)
+
+
+def replace_hashmap(index: Index, hashmap: dict):
+    """
+    Replace the hashmap of an index, only for the current channel if the index is sharded.
+    """
+    if isinstance(index.hashmap, ShardedHashmap):
+        index.hashmap.replace(hashmap)
+    else:
+        set_hashmap(index, hashmap)
@@ -56,6 +56,7 @@ class Comment(Votable):
 class Permission(Record):
     user_address: str
     service_id: str
+    tx_hash: Optional[str] = None
 
 
 class Payment(Record):
@@ -66,3 +67,4 @@ class Payment(Record):
     from_: str = Field(alias="from")
     amount: str
     reference: str
+    service_id: Optional[str] = None
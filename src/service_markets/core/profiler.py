@@ -0,0 +1,226 @@
+# Desc: Opt-in request profiling for production diagnosis.
+# Managers can profile a single request by sending the `X-Profile: 1` header (or `?profile=1`);
+# with `PROFILER_SLOWEST_N` set, the slowest requests are kept along with their profiles.
+# Profiles are sampled with pyinstrument in async mode and stored as collapsed stacks, which can be
+# loaded into flamegraph.pl or speedscope. Without either option, the middleware is not installed.
+import heapq
+import time
+import uuid
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi_walletauth.core import SignatureChallengeTokenAuth
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .constants import SERVICE_MARKETS_MANAGER_PUBKEYS
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None  # type: ignore
+
+PROFILER_ENABLED = getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_SLOWEST_N = int(getenv("PROFILER_SLOWEST_N", 0))
+PROFILER_INTERVAL = float(getenv("PROFILER_INTERVAL", 0.001))
+PROFILER_MAX_PROFILES = int(getenv("PROFILER_MAX_PROFILES", 50))
+PROFILER_MAX_BYTES = int(getenv("PROFILER_MAX_BYTES", 10 * 1024 * 1024))
+
+
+class RequestProfile(BaseModel):
+    id: str
+    method: str
+    path: str
+    status_code: Optional[int]
+    started_at: float
+    duration: float
+    stacks: Optional[str]
+
+    def nbytes(self) -> int:
+        return len(self.stacks or "")
+
+
+def collapsed_stacks(profiler) -> Optional[str]:
+    """
+    Render the last session of a pyinstrument profiler as collapsed stacks ("a;b;c <microseconds>").
+    """
+    root = profiler.last_session.root_frame() if profiler.last_session else None
+    if root is None:
+        return None
+    lines = []
+    stack = [(root, "")]
+    while stack:
+        frame, prefix = stack.pop()
+        name = f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+        path = f"{prefix};{name}" if prefix else name
+        self_time = frame.time - sum(child.time for child in frame.children)
+        if self_time > 0:
+            lines.append(f"{path} {int(self_time * 1_000_000)}")
+        stack.extend((child, path) for child in frame.children)
+    return "\n".join(lines)
+
+
+class ProfileStore:
+    """
+    Keeps the most recent on-demand profiles and the slowest requests, within `max_bytes` of stacks each.
+    """
+
+    def __init__(self, max_profiles: int, slowest_n: int, max_bytes: int):
+        self.max_profiles = max_profiles
+        self.slowest_n = slowest_n
+        self.max_bytes = max_bytes
+        self.recent: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self.recent_bytes = 0
+        self.slowest: List[Tuple[float, str, RequestProfile]] = []
+        self.slowest_bytes = 0
+
+    def add_recent(self, profile: RequestProfile):
+        self.recent[profile.id] = profile
+        self.recent_bytes += profile.nbytes()
+        while self.recent and (
+            len(self.recent) > self.max_profiles or self.recent_bytes > self.max_bytes
+        ):
+            _, evicted = self.recent.popitem(last=False)
+            self.recent_bytes -= evicted.nbytes()
+
+    def is_slow(self, duration: float) -> bool:
+        return self.slowest_n > 0 and (
+            len(self.slowest) < self.slowest_n or duration > self.slowest[0][0]
+        )
+
+    def add_slow(self, profile: RequestProfile):
+        if not self.is_slow(profile.duration):
+            return
+        heapq.heappush(self.slowest, (profile.duration, profile.id, profile))
+        self.slowest_bytes += profile.nbytes()
+        while self.slowest and (
+            len(self.slowest) > self.slowest_n or self.slowest_bytes > self.max_bytes
+        ):
+            _, _, evicted = heapq.heappop(self.slowest)
+            self.slowest_bytes -= evicted.nbytes()
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        profile = self.recent.get(profile_id)
+        if profile is None:
+            profile = next((p for _, i, p in self.slowest if i == profile_id), None)
+        return profile
+
+    def summary(self) -> Dict[str, List[Dict]]:
+        return {
+            "recent": [
+                profile.dict(exclude={"stacks"}) for profile in self.recent.values()
+            ],
+            "slowest": [
+                profile.dict(exclude={"stacks"})
+                for _, _, profile in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+profile_store = ProfileStore(
+    max_profiles=PROFILER_MAX_PROFILES,
+    slowest_n=PROFILER_SLOWEST_N,
+    max_bytes=PROFILER_MAX_BYTES,
+)
+
+
+def profiling_available() -> bool:
+    if not (PROFILER_ENABLED or PROFILER_SLOWEST_N):
+        return False
+    if Profiler is None:
+        print("Profiling is enabled, but pyinstrument is not installed")
+        return False
+    return True
+
+
+class ProfilerMiddleware:
+    """
+    Only one request is sampled at a time, as pyinstrument cannot run several profilers in one thread.
+    On-demand profiles take priority: a request sampled for the slowest requests is preempted by one,
+    and is then recorded without stacks, like slow requests overlapping a profiled one. On-demand
+    requests overlapping another one are answered with `X-Profile-Status: not-sampled`.
+    """
+
+    def __init__(self, app: ASGIApp, store: ProfileStore = profile_store):
+        self.app = app
+        self.store = store
+        self.auth = SignatureChallengeTokenAuth()
+        # the running profiler and whether it was requested
+        self.current: Optional[Tuple[Any, bool]] = None
+
+    def requested(self, scope: Scope) -> bool:
+        if not PROFILER_ENABLED:
+            return False
+        flagged = any(
+            name == b"x-profile" and value == b"1" for name, value in scope["headers"]
+        ) or b"profile=1" in scope["query_string"].split(b"&")
+        if not flagged:
+            return False
+        try:
+            wallet_auth = self.auth(Request(scope))
+        except HTTPException:
+            return False
+        return wallet_auth.address in SERVICE_MARKETS_MANAGER_PUBKEYS
+
+    def _start_profiler(self, requested: bool) -> Optional[Any]:
+        if self.current is not None:
+            running, running_requested = self.current
+            if not requested or running_requested:
+                return None
+            running.stop()
+        profiler = Profiler(interval=PROFILER_INTERVAL, async_mode="enabled")
+        profiler.start()
+        self.current = (profiler, requested)
+        return profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        requested = self.requested(scope)
+        profiler = None
+        if requested or self.store.slowest_n:
+            profiler = self._start_profiler(requested)
+        profile_id = uuid.uuid4().hex
+        status_code = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if requested:
+                    headers = list(message.get("headers", []))
+                    if profiler is not None:
+                        headers.append((b"x-profile-id", profile_id.encode()))
+                    else:
+                        headers.append((b"x-profile-status", b"not-sampled"))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            stacks = None
+            if profiler is not None and profiler.is_running:
+                profiler.stop()
+                stacks = collapsed_stacks(profiler)
+            if self.current is not None and self.current[0] is profiler:
+                self.current = None
+            if requested or self.store.is_slow(duration):
+                profile = RequestProfile(
+                    id=profile_id,
+                    method=scope["method"],
+                    path=scope["path"],
+                    status_code=status_code,
+                    started_at=started_at,
+                    duration=duration,
+                    stacks=stacks,
+                )
+                if requested and profiler is not None:
+                    self.store.add_recent(profile)
+                self.store.add_slow(profile)
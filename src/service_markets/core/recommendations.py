@@ -0,0 +1,281 @@
+# Desc: Precomputed "buyers also bought" and "similar services" recommendations.
+# Co-purchase counts between services sharing buyers are maintained from indexed `Permission` records,
+# tag-overlap (Jaccard) similarity from `Service.tags`, each keeping a bounded top-K list per service.
+# Services sharing very popular tags are left to the periodic full recomputation, which uses sparse
+# matrices when numpy and scipy are installed.
+import asyncio
+import heapq
+from os import getenv
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from aars import Record
+
+from .indexing import IndexListener, local, register_listener
+from .model import Permission, Service
+from .shards import ShardManager, shard_manager
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None  # type: ignore
+    sparse = None  # type: ignore
+
+RELATED_TOP_K = int(getenv("RELATED_TOP_K", 10))
+RELATED_MAX_INCREMENTAL_CANDIDATES = int(
+    getenv("RELATED_MAX_INCREMENTAL_CANDIDATES", 1000)
+)
+RELATED_RECOMPUTE_INTERVAL = float(getenv("RELATED_RECOMPUTE_INTERVAL", 0))
+
+Neighbours = List[Tuple[str, float]]
+
+
+def offer(neighbours: Neighbours, service_id: str, score: float, k: int):
+    """
+    Update a top-K neighbour list, sorted by descending score, with a new score for a service.
+    """
+    for i, (neighbour, _) in enumerate(neighbours):
+        if neighbour == service_id:
+            del neighbours[i]
+            break
+    if len(neighbours) >= k and score <= neighbours[-1][1]:
+        return
+    neighbours.append((service_id, score))
+    neighbours.sort(key=lambda neighbour: -neighbour[1])
+    del neighbours[k:]
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def top_k_python(
+    purchases: Dict[str, Set[str]], tags: Dict[str, FrozenSet[str]], k: int
+) -> Tuple[Dict[str, Neighbours], Dict[str, Neighbours]]:
+    co_counts: Dict[str, Dict[str, float]] = {}
+    for services in purchases.values():
+        for service in services:
+            counts = co_counts.setdefault(service, {})
+            for other in services:
+                if other != service:
+                    counts[other] = counts.get(other, 0) + 1
+    also_bought = {
+        service: heapq.nlargest(k, counts.items(), key=lambda item: item[1])
+        for service, counts in co_counts.items()
+    }
+    services_by_tag: Dict[str, Set[str]] = {}
+    for service, service_tags in tags.items():
+        for tag in service_tags:
+            services_by_tag.setdefault(tag, set()).add(service)
+    similar = {}
+    for service, service_tags in tags.items():
+        candidates = set().union(*(services_by_tag[tag] for tag in service_tags))
+        candidates.discard(service)
+        similar[service] = heapq.nlargest(
+            k,
+            ((other, jaccard(service_tags, tags[other])) for other in candidates),
+            key=lambda item: item[1],
+        )
+    return also_bought, similar
+
+
+def sparse_rows_top_k(matrix, ids: List[str], k: int) -> Dict[str, Neighbours]:
+    matrix = matrix.tocsr()
+    result = {}
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if start == end:
+            continue
+        scores = matrix.data[start:end]
+        columns = matrix.indices[start:end]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+            scores, columns = scores[best], columns[best]
+        order = np.argsort(-scores, kind="stable")
+        result[ids[row]] = [(ids[columns[i]], float(scores[i])) for i in order]
+    return result
+
+
+def top_k_sparse(
+    purchases: Dict[str, Set[str]], tags: Dict[str, FrozenSet[str]], k: int
+) -> Tuple[Dict[str, Neighbours], Dict[str, Neighbours]]:
+    ids = sorted(set(tags).union(*purchases.values()))
+    service_index = {service: i for i, service in enumerate(ids)}
+
+    # buyers x services, then services x services co-purchase counts
+    rows: List[int] = []
+    columns: List[int] = []
+    for buyer, (_, services) in enumerate(purchases.items()):
+        rows.extend([buyer] * len(services))
+        columns.extend(service_index[service] for service in services)
+    bought = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(purchases), len(ids)),
+    )
+    co_counts = (bought.T @ bought).tocsr()
+    co_counts.setdiag(0)
+    co_counts.eliminate_zeros()
+
+    # services x tags, then Jaccard similarity of all pairs sharing a tag
+    tag_index: Dict[str, int] = {}
+    rows, columns = [], []
+    for service, service_tags in tags.items():
+        for tag in service_tags:
+            rows.append(service_index[service])
+            columns.append(tag_index.setdefault(tag, len(tag_index)))
+    tagged = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, columns)),
+        shape=(len(ids), len(tag_index)),
+    )
+    overlap = (tagged @ tagged.T).tocoo()
+    sizes = np.asarray(tagged.sum(axis=1)).ravel()
+    union = sizes[overlap.row] + sizes[overlap.col] - overlap.data
+    similarity = sparse.csr_matrix(
+        (overlap.data / union, (overlap.row, overlap.col)), shape=overlap.shape
+    )
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    return sparse_rows_top_k(co_counts, ids, k), sparse_rows_top_k(similarity, ids, k)
+
+
+class RelatedServices(IndexListener):
+    record_types = (Service, Permission)
+
+    def __init__(self, k: int, max_incremental_candidates: int):
+        self.k = k
+        self.max_incremental_candidates = max_incremental_candidates
+        self.clear()
+
+    def clear(self):
+        self.purchases: Dict[str, Set[str]] = {}
+        self.co_counts: Dict[str, Dict[str, int]] = {}
+        self.tags: Dict[str, FrozenSet[str]] = {}
+        self.services_by_tag: Dict[str, Set[str]] = {}
+        self.also_bought: Dict[str, Neighbours] = {}
+        self.similar: Dict[str, Neighbours] = {}
+        # whether some neighbour lists may miss entries that only a full recomputation restores
+        self.stale = False
+        self.changes = 0
+
+    def add_record(self, record: Record):
+        self.changes += 1
+        if isinstance(record, Permission):
+            self._add_purchase(record.user_address, record.service_id)
+        elif isinstance(record, Service):
+            assert record.item_hash is not None
+            self._set_tags(record.item_hash, frozenset(record.tags))
+
+    def _add_purchase(self, buyer: str, service_id: str):
+        services = self.purchases.setdefault(buyer, set())
+        if service_id in services:
+            return
+        counts = self.co_counts.setdefault(service_id, {})
+        for other in services:
+            counts[other] = counts.get(other, 0) + 1
+            other_counts = self.co_counts.setdefault(other, {})
+            other_counts[service_id] = other_counts.get(service_id, 0) + 1
+            offer(
+                self.also_bought.setdefault(service_id, []),
+                other,
+                counts[other],
+                self.k,
+            )
+            offer(
+                self.also_bought.setdefault(other, []),
+                service_id,
+                other_counts[service_id],
+                self.k,
+            )
+        services.add(service_id)
+
+    def _candidates(self, tags: FrozenSet[str]) -> Set[str]:
+        return set().union(*(self.services_by_tag.get(tag, ()) for tag in tags))
+
+    def _set_tags(self, service_id: str, tags: FrozenSet[str]):
+        old_tags = self.tags.get(service_id)
+        if old_tags == tags:
+            return
+        if old_tags:
+            for tag in old_tags:
+                self.services_by_tag[tag].discard(service_id)
+        self.tags[service_id] = tags
+        for tag in tags:
+            self.services_by_tag.setdefault(tag, set()).add(service_id)
+
+        candidates = self._candidates(tags) | self._candidates(old_tags or frozenset())
+        candidates.discard(service_id)
+        if len(candidates) > self.max_incremental_candidates:
+            self.stale = True
+            return
+        scores = [(other, jaccard(tags, self.tags[other])) for other in candidates]
+        self.similar[service_id] = heapq.nlargest(
+            self.k,
+            ((other, score) for other, score in scores if score > 0),
+            key=lambda item: item[1],
+        )
+        for other, score in scores:
+            neighbours = self.similar.setdefault(other, [])
+            if score > 0:
+                offer(neighbours, service_id, score, self.k)
+            elif any(neighbour == service_id for neighbour, _ in neighbours):
+                # no tags in common anymore, the freed slot needs a full recomputation
+                neighbours[:] = [n for n in neighbours if n[0] != service_id]
+                self.stale = True
+
+    def related(
+        self, service_id: str, limit: Optional[int] = None
+    ) -> Tuple[Neighbours, Neighbours]:
+        limit = self.k if limit is None else limit
+        return (
+            self.also_bought.get(service_id, [])[:limit],
+            self.similar.get(service_id, [])[:limit],
+        )
+
+    async def recompute(self):
+        """
+        Recompute all neighbour lists from scratch in a worker thread, from a snapshot of the signals.
+        """
+        purchases = {buyer: set(services) for buyer, services in self.purchases.items()}
+        tags = dict(self.tags)
+        changes = self.changes
+        compute = top_k_sparse if sparse is not None else top_k_python
+        loop = asyncio.get_event_loop()
+        also_bought, similar = await loop.run_in_executor(
+            None, compute, purchases, tags, self.k
+        )
+        self.also_bought = also_bought
+        self.similar = similar
+        # records indexed while computing are missing from the new lists until the next run
+        self.stale = self.changes != changes
+
+
+async def recompute_periodically(
+    related: RelatedServices,
+    interval: float = RELATED_RECOMPUTE_INTERVAL,
+    manager: ShardManager = shard_manager,
+):
+    """
+    Recompute the stale neighbour lists of the default channel and of every loaded channel.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        instances = [related]
+        for shard in list(manager.shards.values()):
+            with shard.entered():
+                instances.append(local(related))
+        for instance in instances:
+            if not instance.stale:
+                continue
+            try:
+                await instance.recompute()
+            except Exception as e:
+                print(f"Recomputing related services failed: {e!r}")
+
+
+related_services = register_listener(
+    RelatedServices(
+        k=RELATED_TOP_K, max_incremental_candidates=RELATED_MAX_INCREMENTAL_CANDIDATES
+    )
+)
@@ -0,0 +1,286 @@
+# Desc: Reconciliation of payments between the Request Network subgraph and the indexed records.
+# `PUT /services/{id}/payment/{tx_hash}` saves a `Payment` and then a `Permission`; when it fails midway
+# one of them is missing. This job pages through the subgraph payments to our receiving addresses,
+# diffs them against the indexed `Payment` and `Permission` records and saves the missing ones.
+# What it needs of the indexed records is kept up to date by `PaymentLedger` as they are indexed, so a
+# run only reads the subgraph. Runs are serialized, as concurrent ones would save the same records.
+# Run it with `python -m service_markets.core.reconcile`, or periodically within the API by setting
+# `RECONCILE_INTERVAL`.
+import argparse
+import asyncio
+import json
+import os
+from os import getenv
+from typing import Dict, List, Optional, Set, Tuple
+
+from aars import Record
+from pydantic import BaseModel
+
+from .generations import index_manager
+from .indexing import IndexListener, local, notify_listeners, register_listener
+from .model import Payment, Permission, Service
+from .request_network import fetch_payments, fetch_payments_by_tx_hashes
+from .session import initialize_aars
+
+RECONCILE_BATCH_SIZE = int(getenv("RECONCILE_BATCH_SIZE", 1000))
+RECONCILE_SAVE_BATCH_SIZE = int(getenv("RECONCILE_SAVE_BATCH_SIZE", 20))
+RECONCILE_CHECKPOINT_PATH = getenv(
+    "RECONCILE_CHECKPOINT_PATH", "reconcile_checkpoint.json"
+)
+RECONCILE_INTERVAL = float(getenv("RECONCILE_INTERVAL", 0))
+
+SUBGRAPH_ONLY_FIELDS = ("id", "timestamp")
+
+reconcile_lock = asyncio.Lock()
+
+
+class ReconcileCheckpoint(BaseModel):
+    timestamp: int = 0
+    # subgraph payments before `timestamp` that could not be attributed yet, by tx hash
+    unattributed: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "ReconcileCheckpoint":
+        if not os.path.exists(path):
+            return cls()
+        return cls.parse_file(path)
+
+    def save(self, path: str):
+        # write to a temporary file first, so that a crash never leaves a corrupt checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.json())
+        os.replace(tmp_path, path)
+
+
+class PaymentLedger(IndexListener):
+    """
+    The indexed payments and permissions by transaction hash, and services by owner address.
+    """
+
+    record_types = (Service, Payment, Permission)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # tx hash -> (service id, payer address)
+        self.payments: Dict[str, Tuple[Optional[str], str]] = {}
+        # tx hash -> service id
+        self.permissions: Dict[str, str] = {}
+        self.receivers: Set[str] = set()
+        self.services_by_owner: Dict[str, Set[str]] = {}
+        self.service_owners: Dict[str, str] = {}
+
+    def add_record(self, record: Record):
+        if isinstance(record, Service):
+            self._add_service(record)
+        elif isinstance(record, Payment):
+            self.payments[record.txHash] = (record.service_id, record.from_)
+            self.receivers.add(record.to.lower())
+        elif isinstance(record, Permission) and record.tx_hash is not None:
+            self.permissions[record.tx_hash] = record.service_id
+
+    def _add_service(self, service: Service):
+        assert service.item_hash is not None
+        owner = service.owner_address.lower()
+        old_owner = self.service_owners.get(service.item_hash)
+        if old_owner == owner:
+            return
+        if old_owner is not None:
+            self.services_by_owner[old_owner].discard(service.item_hash)
+        self.service_owners[service.item_hash] = owner
+        self.services_by_owner.setdefault(owner, set()).add(service.item_hash)
+
+
+payment_ledger = register_listener(PaymentLedger())
+
+
+class ReconcileReport(BaseModel):
+    checkpoint: int
+    subgraph_payments: int = 0
+    payments_created: int = 0
+    permissions_created: int = 0
+    unattributed_tx_hashes: List[str] = []
+    dry_run: bool = False
+
+
+def to_payment(raw: dict, service_id: str) -> Payment:
+    fields = {k: v for k, v in raw.items() if k not in SUBGRAPH_ONLY_FIELDS}
+    return Payment(**fields, service_id=service_id)
+
+
+async def save_in_batches(records: List[Record], batch_size: int):
+    for i in range(0, len(records), batch_size):
+        batch = records[i : i + batch_size]
+        await asyncio.gather(*(record.save() for record in batch))
+        notify_listeners(*batch)
+
+
+async def fetch_new_subgraph_payments(
+    to_addresses: List[str], since: int, batch_size: int
+) -> Dict[str, dict]:
+    payments: Dict[str, dict] = {}
+    if not to_addresses:
+        return payments
+    after_id = ""
+    while True:
+        batch = await fetch_payments(to_addresses, since, after_id, batch_size)
+        for raw in batch:
+            payments[raw["txHash"]] = raw
+        if len(batch) < batch_size:
+            return payments
+        after_id = batch[-1]["id"]
+
+
+async def reconcile(
+    checkpoint_path: str = RECONCILE_CHECKPOINT_PATH,
+    batch_size: int = RECONCILE_BATCH_SIZE,
+    save_batch_size: int = RECONCILE_SAVE_BATCH_SIZE,
+    full: bool = False,
+    dry_run: bool = False,
+) -> ReconcileReport:
+    """
+    Save the `Permission` missing for indexed payments, the `Payment` missing for permissions, and both
+    records for subgraph payments since the last checkpoint that were never registered, as long as the
+    receiving address owns exactly one service.
+    """
+    async with reconcile_lock:
+        return await _reconcile(
+            checkpoint_path, batch_size, save_batch_size, full, dry_run
+        )
+
+
+async def _reconcile(
+    checkpoint_path: str,
+    batch_size: int,
+    save_batch_size: int,
+    full: bool,
+    dry_run: bool,
+) -> ReconcileReport:
+    checkpoint = (
+        ReconcileCheckpoint() if full else ReconcileCheckpoint.load(checkpoint_path)
+    )
+    ledger = local(payment_ledger)
+    payments_by_tx = dict(ledger.payments)
+    permissions_by_tx = dict(ledger.permissions)
+    to_addresses = sorted(
+        ledger.receivers
+        | {
+            owner
+            for owner, services in ledger.services_by_owner.items()
+            if owner.startswith("0x") and services
+        }
+    )
+    subgraph_payments = await fetch_new_subgraph_payments(
+        to_addresses, checkpoint.timestamp, batch_size
+    )
+    for tx_hash, raw in checkpoint.unattributed.items():
+        subgraph_payments.setdefault(tx_hash, raw)
+    report = ReconcileReport(
+        checkpoint=checkpoint.timestamp,
+        subgraph_payments=len(subgraph_payments),
+        dry_run=dry_run,
+    )
+
+    # payments saved without their permission
+    new_permissions: List[Record] = [
+        Permission(
+            service_id=service_id,
+            user_address=payer,
+            tx_hash=tx_hash,
+        )
+        for tx_hash, (service_id, payer) in payments_by_tx.items()
+        if tx_hash not in permissions_by_tx and service_id
+    ]
+
+    # permissions saved without their payment
+    missing_payments = set(permissions_by_tx) - set(payments_by_tx)
+    unknown = sorted(missing_payments - set(subgraph_payments))
+    for i in range(0, len(unknown), batch_size):
+        for raw in await fetch_payments_by_tx_hashes(unknown[i : i + batch_size]):
+            subgraph_payments.setdefault(raw["txHash"], raw)
+    new_payments: List[Record] = [
+        to_payment(subgraph_payments[tx_hash], permissions_by_tx[tx_hash])
+        for tx_hash in sorted(missing_payments)
+        if tx_hash in subgraph_payments
+    ]
+
+    # payments on chain that were never registered
+    unattributed: Dict[str, dict] = {}
+    for tx_hash in sorted(
+        subgraph_payments.keys() - payments_by_tx.keys() - missing_payments
+    ):
+        raw = subgraph_payments[tx_hash]
+        owned_services = ledger.services_by_owner.get(raw["to"].lower(), set())
+        if len(owned_services) != 1:
+            unattributed[tx_hash] = raw
+            continue
+        (service_id,) = owned_services
+        new_payments.append(to_payment(raw, service_id))
+        new_permissions.append(
+            Permission(
+                service_id=service_id,
+                user_address=raw["from"],
+                tx_hash=tx_hash,
+            )
+        )
+
+    report.unattributed_tx_hashes = list(unattributed)
+    report.payments_created = len(new_payments)
+    report.permissions_created = len(new_permissions)
+    if dry_run:
+        return report
+    await save_in_batches(new_payments, save_batch_size)
+    await save_in_batches(new_permissions, save_batch_size)
+    if subgraph_payments:
+        checkpoint.timestamp = max(
+            checkpoint.timestamp,
+            *(int(raw["timestamp"]) for raw in subgraph_payments.values()),
+        )
+    # the checkpoint moves past them, so they are retried from the checkpoint itself
+    checkpoint.unattributed = unattributed
+    checkpoint.save(checkpoint_path)
+    return report
+
+
+async def reconcile_periodically(interval: float = RECONCILE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await reconcile()
+            print(f"Reconciled payments: {report.json()}")
+        except Exception as e:
+            print(f"Payment reconciliation failed: {e!r}")
+
+
+async def run(args: argparse.Namespace) -> ReconcileReport:
+    await initialize_aars()
+    # indexing the channel once fills the ledger the run is diffed against
+    await index_manager.rebuild()
+    return await reconcile(
+        checkpoint_path=args.checkpoint,
+        batch_size=args.batch_size,
+        full=args.full,
+        dry_run=args.dry_run,
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Reconcile payments and permissions with the Request Network subgraph"
+    )
+    parser.add_argument("--checkpoint", default=RECONCILE_CHECKPOINT_PATH)
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the checkpoint and scan everything"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report without saving anything"
+    )
+    report = asyncio.run(run(parser.parse_args(argv)))
+    print(json.dumps(report.dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,79 @@
 import aiohttp
 import requests
 import json
+from typing import List
 
 from .model import Payment
 
+# The endpoint URL for the Request Payments Subgraph
+PAYMENTS_SUBGRAPH_URL = (
+    "https://api.thegraph.com/subgraphs/name/requestnetwork/request-payments-goerli"
+)
 
-async def fetch_payment(tx_hash: str) -> Payment:
-    url = (
-        "https://api.thegraph.com/subgraphs/name/requestnetwork/request-payments-goerli"
-    )
 
+async def query_subgraph(query: str) -> dict:
     headers = {"Content-Type": "application/json"}
-    request_json = json.dumps({"query": payment_query.format(tx_hash)})
+    request_json = json.dumps({"query": query})
 
     # Initiate the session
     async with aiohttp.ClientSession() as session:
         # Post the query
-        async with session.post(url, headers=headers, data=request_json) as response:
+        async with session.post(
+            PAYMENTS_SUBGRAPH_URL, headers=headers, data=request_json
+        ) as response:
             # Raise an exception in case of status error
             response.raise_for_status()
 
             # Fetch the json response
             json_response = await response.json()
 
-    return Payment(**(await response.json())["data"]["payments"][0])
+    if json_response.get("errors"):
+        raise ValueError(f"Subgraph query failed: {json_response['errors']}")
+    return json_response["data"]
 
 
-def fetch_payment_sync(tx_hash: str) -> Payment:
-    # The endpoint URL for the Request Payments Subgraph
-    url = (
-        "https://api.thegraph.com/subgraphs/name/requestnetwork/request-payments-goerli"
+async def fetch_payment(tx_hash: str) -> Payment:
+    data = await query_subgraph(payment_query.format(tx_hash))
+    return Payment(**data["payments"][0])
+
+
+async def fetch_payments(
+    to_addresses: List[str],
+    since: int = 0,
+    after_id: str = "",
+    batch_size: int = 1000,
+) -> List[dict]:
+    """
+    Fetch one batch of raw subgraph payments to the given addresses, made after the `since` timestamp
+    and ordered by id. Pass the id of the last payment as `after_id` to fetch the next batch.
+    """
+    data = await query_subgraph(
+        payments_batch_query.format(
+            first=batch_size,
+            to=json.dumps(to_addresses),
+            since=since,
+            after_id=after_id,
+        )
     )
+    return data["payments"]
+
+
+async def fetch_payments_by_tx_hashes(tx_hashes: List[str]) -> List[dict]:
+    data = await query_subgraph(
+        payments_by_tx_hashes_query.format(
+            first=len(tx_hashes), tx_hashes=json.dumps(tx_hashes)
+        )
+    )
+    return data["payments"]
+
 
+def fetch_payment_sync(tx_hash: str) -> Payment:
     headers = {"Content-Type": "application/json"}
 
     request_json = json.dumps({"query": payment_query.format(tx_hash)})
 
     # Post the query
-    response = requests.post(url, headers=headers, data=request_json)
+    response = requests.post(PAYMENTS_SUBGRAPH_URL, headers=headers, data=request_json)
 
     # Raise an exception in case of status error
     response.raise_for_status()
@@ -58,3 +94,39 @@ payment_query = """
   }}
 }}
 """
+
+payments_batch_query = """
+{{
+  payments(
+    first: {first}
+    orderBy: id
+    where: {{to_in: {to}, timestamp_gt: {since}, id_gt: "{after_id}"}}
+  ) {{
+    id
+    amount
+    txHash
+    from
+    to
+    contractAddress
+    tokenAddress
+    reference
+    timestamp
+  }}
+}}
+"""
+
+payments_by_tx_hashes_query = """
+{{
+  payments(first: {first}, where: {{txHash_in: {tx_hashes}}}) {{
+    id
+    amount
+    txHash
+    from
+    to
+    contractAddress
+    tokenAddress
+    reference
+    timestamp
+  }}
+}}
+"""
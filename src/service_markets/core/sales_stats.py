@@ -0,0 +1,216 @@
+# Desc: Incrementally maintained sales and revenue aggregates per service and per owner.
+# A sale is a `Permission`, revenue comes from the `Payment` it was granted for. Both are counted
+# into hourly and daily buckets as they are indexed, so that stats are served in O(buckets).
+import time
+from decimal import Decimal, InvalidOperation
+from enum import Enum
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from aars import Record
+
+from .indexing import IndexListener, register_listener
+from .model import Payment, Permission, Service
+
+
+class Granularity(str, Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+
+BUCKET_SECONDS = {
+    Granularity.HOUR: 3600,
+    Granularity.DAY: 86400,
+}
+
+
+class SalesBucket:
+    __slots__ = ("sales", "revenue", "buyers")
+
+    def __init__(self):
+        self.sales = 0
+        self.revenue: Dict[str, Decimal] = {}
+        self.buyers: Set[str] = set()
+
+    def add_sale(self, buyer: str):
+        self.sales += 1
+        self.buyers.add(buyer)
+
+    def add_revenue(self, token: str, amount: Decimal):
+        self.revenue[token] = self.revenue.get(token, Decimal(0)) + amount
+
+    def merge(self, other: "SalesBucket"):
+        self.sales += other.sales
+        self.buyers |= other.buyers
+        for token, amount in other.revenue.items():
+            self.add_revenue(token, amount)
+
+
+class SalesSeries:
+    """
+    Totals and time buckets of one service or owner.
+    """
+
+    def __init__(self):
+        self.total = SalesBucket()
+        self.buckets: Dict[Granularity, Dict[int, SalesBucket]] = {
+            granularity: {} for granularity in Granularity
+        }
+
+    def _buckets_at(self, timestamp: float) -> Iterator[SalesBucket]:
+        yield self.total
+        for granularity, buckets in self.buckets.items():
+            seconds = BUCKET_SECONDS[granularity]
+            start = int(timestamp // seconds * seconds)
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = SalesBucket()
+            yield bucket
+
+    def add_sale(self, timestamp: float, buyer: str):
+        for bucket in self._buckets_at(timestamp):
+            bucket.add_sale(buyer)
+
+    def add_revenue(self, timestamp: float, token: str, amount: Decimal):
+        for bucket in self._buckets_at(timestamp):
+            bucket.add_revenue(token, amount)
+
+    def merge(self, other: "SalesSeries"):
+        self.total.merge(other.total)
+        for granularity, buckets in other.buckets.items():
+            own_buckets = self.buckets[granularity]
+            for start, bucket in buckets.items():
+                own_bucket = own_buckets.get(start)
+                if own_bucket is None:
+                    own_bucket = own_buckets[start] = SalesBucket()
+                own_bucket.merge(bucket)
+
+    def range(
+        self,
+        granularity: Granularity,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> Iterator[Tuple[int, SalesBucket]]:
+        buckets = self.buckets[granularity]
+        for start in sorted(buckets):
+            if since is not None and start + BUCKET_SECONDS[granularity] <= since:
+                continue
+            if until is not None and start > until:
+                break
+            yield start, buckets[start]
+
+
+def parse_amount(amount: str) -> Optional[Decimal]:
+    try:
+        value = Decimal(amount)
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() else None
+
+
+class SalesStats(IndexListener):
+    """
+    Payments are attributed to a service through `Payment.service_id`, or for older payments through
+    the `Permission.tx_hash` or `Service.payment_id` pointing to them. Payments that cannot be
+    attributed yet are kept aside until the record linking them is indexed.
+    Owners are resolved through `Service.owner_address`; sales of services that are not indexed yet
+    are added to the owner's stats as soon as the service is.
+    """
+
+    record_types = (Service, Permission, Payment)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.services: Dict[str, SalesSeries] = {}
+        self.owners: Dict[str, SalesSeries] = {}
+        self.service_owners: Dict[str, str] = {}
+        self.counted: Set[str] = set()
+        self.service_by_tx_hash: Dict[str, str] = {}
+        self.service_by_payment_id: Dict[str, str] = {}
+        self.unattributed_payments: Dict[str, Payment] = {}
+        # item hash -> tx hash of the unattributed payments, to resolve `Service.payment_id`
+        self.unattributed_tx_hashes: Dict[str, str] = {}
+
+    def add_record(self, record: Record):
+        if isinstance(record, Service):
+            self._add_service(record)
+        elif isinstance(record, Permission):
+            self._add_permission(record)
+        elif isinstance(record, Payment):
+            self._add_payment(record)
+
+    def _series(self, service_id: str) -> Iterator[SalesSeries]:
+        series = self.services.get(service_id)
+        if series is None:
+            series = self.services[service_id] = SalesSeries()
+        yield series
+        owner = self.service_owners.get(service_id)
+        if owner is not None:
+            owner_series = self.owners.get(owner)
+            if owner_series is None:
+                owner_series = self.owners[owner] = SalesSeries()
+            yield owner_series
+
+    def _add_service(self, service: Service):
+        assert service.item_hash is not None
+        if service.payment_id:
+            self.service_by_payment_id[service.payment_id] = service.item_hash
+            tx_hash = self.unattributed_tx_hashes.get(service.payment_id)
+            if tx_hash is not None:
+                self._attribute(self.unattributed_payments.get(tx_hash))
+        if service.item_hash in self.service_owners:
+            # sales stay attributed to the owner at the time they were made
+            return
+        self.service_owners[service.item_hash] = service.owner_address
+        series = self.services.get(service.item_hash)
+        if series is not None:
+            owner_series = self.owners.get(service.owner_address)
+            if owner_series is None:
+                owner_series = self.owners[service.owner_address] = SalesSeries()
+            owner_series.merge(series)
+
+    def _add_permission(self, permission: Permission):
+        assert permission.item_hash is not None
+        if permission.item_hash in self.counted:
+            return
+        self.counted.add(permission.item_hash)
+        timestamp = permission.timestamp or time.time()
+        for series in self._series(permission.service_id):
+            series.add_sale(timestamp, permission.user_address)
+        if permission.tx_hash:
+            self.service_by_tx_hash[permission.tx_hash] = permission.service_id
+            self._attribute(self.unattributed_payments.get(permission.tx_hash))
+
+    def _add_payment(self, payment: Payment):
+        assert payment.item_hash is not None
+        if payment.item_hash in self.counted:
+            return
+        service_id = (
+            payment.service_id
+            or self.service_by_tx_hash.get(payment.txHash)
+            or self.service_by_payment_id.get(payment.item_hash)
+        )
+        if service_id is None:
+            self.unattributed_payments[payment.txHash] = payment
+            self.unattributed_tx_hashes[payment.item_hash] = payment.txHash
+            return
+        self.counted.add(payment.item_hash)
+        amount = parse_amount(payment.amount)
+        if amount is None:
+            print(
+                f"Payment {payment.item_hash} has an invalid amount: {payment.amount!r}"
+            )
+            return
+        timestamp = payment.timestamp or time.time()
+        for series in self._series(service_id):
+            series.add_revenue(timestamp, payment.tokenAddress, amount)
+
+    def _attribute(self, payment: Optional[Payment]):
+        if payment is not None:
+            del self.unattributed_payments[payment.txHash]
+            self.unattributed_tx_hashes.pop(str(payment.item_hash), None)
+            self._add_payment(payment)
+
+
+sales_stats = register_listener(SalesStats())
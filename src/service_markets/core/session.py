@@ -1,6 +1,6 @@
 from datetime import datetime
 from os import getenv
-from typing import Optional
+from typing import Optional, Union
 
 from aars import AARS
 from aleph.sdk.client import AuthenticatedAlephClient
@@ -9,6 +9,7 @@ from aleph.sdk.conf import settings
 from aleph.sdk.types import Account
 from aleph.sdk.vm.cache import TestVmCache, VmCache
 
+from .aleph_client import ALEPH_HEDGE_API_HOST, ResilientAlephClient
 from .constants import SERVICE_MARKETS_MESSAGE_CHANNEL, SERVICE_MARKETS_MANAGER_PUBKEYS
 
 
@@ -17,7 +18,9 @@ async def initialize_aars(
     test_channel_flag: Optional[bool] = None,
     custom_channel: Optional[str] = None,
     account: Optional[Account] = None,
-    aleph_session: Optional[AuthenticatedAlephClient] = None,
+    aleph_session: Optional[
+        Union[AuthenticatedAlephClient, ResilientAlephClient]
+    ] = None,
 ) -> AARS:
     test_cache_flag = test_cache_flag or getenv("TEST_CACHE")
     if test_cache_flag is not None and test_cache_flag.lower() == "false":
@@ -26,11 +29,13 @@ async def initialize_aars(
         cache = TestVmCache()
 
     aleph_account = get_fallback_account() if account is None else account
-    aleph_session = (
-        AuthenticatedAlephClient(aleph_account, settings.API_HOST)
-        if aleph_session is None
-        else aleph_session
-    )
+    if aleph_session is None:
+        aleph_session = ResilientAlephClient(
+            AuthenticatedAlephClient(aleph_account, settings.API_HOST),
+            hedge_client=AuthenticatedAlephClient(aleph_account, ALEPH_HEDGE_API_HOST)
+            if ALEPH_HEDGE_API_HOST
+            else None,
+        )
 
     test_channel_flag = test_channel_flag or getenv("TEST_CHANNEL")
     custom_channel = (
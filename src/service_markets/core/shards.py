@@ -0,0 +1,256 @@
+# Desc: Serving several Aleph channels from one API process.
+# Requests are routed to a channel by host (`SHARD_HOSTS`) or by a `/channels/{channel}` path prefix.
+# Each channel other than the default one gets its own index hashmaps and listener instances, loaded
+# lazily on its first request and evicted when idle. All channels share the Aleph session, which posts to
+# and reads from the channel of the current request, and a single watcher for their new messages.
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import getenv
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from aars import AARS
+from aleph_message.models import MessageType, PostMessage
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .aleph_client import channel_override, request_deadline
+from .constants import API_MESSAGE_FILTER
+from .generations import index_manager, index_post
+from .indexing import ShardState, current_shard, local, shard_index, unshard_index
+
+SHARD_CHANNELS = [
+    channel for channel in getenv("SHARD_CHANNELS", "").split(",") if channel
+]
+SHARD_HOSTS = dict(
+    pair.split("=", 1) for pair in getenv("SHARD_HOSTS", "").split(",") if "=" in pair
+)
+SHARD_MAX_LOADED = int(getenv("SHARD_MAX_LOADED", 8))
+SHARD_IDLE_TIMEOUT = float(getenv("SHARD_IDLE_TIMEOUT", 3600))
+SHARD_PATH_PREFIX = "/channels/"
+# the watcher is restarted whenever the set of loaded channels changes, re-reading this many seconds
+# of messages so that none are missed in between; already indexed ones are skipped
+WATCH_OVERLAP = 10
+
+
+class Shard:
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.state = ShardState(channel)
+        self.loading: Optional[asyncio.Future] = None
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    @contextmanager
+    def entered(self) -> Iterator[None]:
+        shard_token = current_shard.set(self.state)
+        channel_token = channel_override.set(self.channel)
+        try:
+            yield
+        finally:
+            channel_override.reset(channel_token)
+            current_shard.reset(shard_token)
+
+
+class ShardManager:
+    def __init__(
+        self,
+        channels: List[str],
+        hosts: Dict[str, str],
+        max_loaded: int,
+        idle_timeout: float,
+    ):
+        self.hosts = hosts
+        self.allowed = set(channels) | set(hosts.values())
+        self.max_loaded = max_loaded
+        self.idle_timeout = idle_timeout
+        self.shards: "OrderedDict[str, Shard]" = OrderedDict()
+        self.watcher: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.allowed)
+
+    def install(self):
+        """
+        Make the AARS indices of all record types channel-aware.
+        """
+        for record_type in index_manager.record_types:
+            for index in record_type.get_indices():
+                shard_index(index)
+
+    def uninstall(self):
+        """
+        Give the AARS indices back their hashmap of the default channel.
+        """
+        for record_type in index_manager.record_types:
+            for index in record_type.get_indices():
+                unshard_index(index)
+
+    def route(self, scope: Scope) -> Tuple[Optional[str], Scope]:
+        """
+        Get the channel a request is for and the scope to pass on, without the channel path prefix.
+        """
+        path: str = scope["path"]
+        if path.startswith(SHARD_PATH_PREFIX):
+            channel, _, rest = path[len(SHARD_PATH_PREFIX) :].partition("/")
+            prefix = SHARD_PATH_PREFIX + channel
+            scope = {
+                **scope,
+                "path": "/" + rest,
+                "raw_path": ("/" + rest).encode(),
+                "root_path": scope.get("root_path", "") + prefix,
+            }
+            return channel, scope
+        for name, value in scope["headers"]:
+            if name == b"host":
+                return self.hosts.get(value.decode().split(":")[0]), scope
+        return None, scope
+
+    async def acquire(self, channel: str) -> Shard:
+        shard = self.shards.get(channel)
+        created = shard is None
+        if shard is None:
+            shard = self.shards[channel] = Shard(channel)
+            shard.loading = asyncio.ensure_future(self._load(shard))
+        else:
+            self.shards.move_to_end(channel)
+        shard.active += 1
+        if self._evict() or created:
+            self._restart_watcher()
+        assert shard.loading is not None
+        try:
+            await asyncio.shield(shard.loading)
+        except BaseException:
+            # also when the request is cancelled while waiting, which leaves the loading running
+            self.release(shard)
+            if shard.loading.done() and self.shards.get(channel) is shard:
+                del self.shards[channel]
+                self._restart_watcher()
+            raise
+        return shard
+
+    def release(self, shard: Shard):
+        shard.active -= 1
+        shard.last_used = time.monotonic()
+
+    async def _load(self, shard: Shard):
+        # the first request for a channel starts loading it, but must not impose its deadline on it
+        request_deadline.set(None)
+        print(f"Loading channel {shard.channel}")
+        with shard.entered():
+            await local(index_manager).rebuild()
+        self.loads += 1
+        print(f"Channel {shard.channel} loaded")
+
+    def _evict(self) -> bool:
+        """
+        Drop idle shards and, beyond `max_loaded`, the least recently used ones without active requests.
+        """
+        now = time.monotonic()
+        evicted = False
+        for channel, shard in list(self.shards.items()):
+            if shard.active:
+                continue
+            if (
+                len(self.shards) > self.max_loaded
+                or now - shard.last_used > self.idle_timeout
+            ):
+                if shard.loading and not shard.loading.done():
+                    shard.loading.cancel()
+                del self.shards[channel]
+                self.evictions += 1
+                evicted = True
+        return evicted
+
+    def _restart_watcher(self):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
+        if self.shards:
+            self.watcher = asyncio.ensure_future(
+                self._watch(list(self.shards), time.time() - WATCH_OVERLAP)
+            )
+
+    async def _watch(self, channels: List[str], start_date: float):
+        async for message in AARS.session.watch_messages(
+            start_date=start_date,
+            message_type=MessageType(API_MESSAGE_FILTER[0]["type"]),
+            content_types=API_MESSAGE_FILTER[0]["post_type"],
+            channels=channels,
+        ):
+            shard = self.shards.get(message.channel)
+            if shard is None or not isinstance(message, PostMessage):
+                continue
+            try:
+                with shard.entered():
+                    await index_post(message)
+            except Exception as e:
+                print(f"Failed to index message {message.item_hash}: {e!r}")
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "allowed": sorted(self.allowed),
+            "max_loaded": self.max_loaded,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "loaded": {
+                channel: {
+                    "ready": bool(shard.loading and shard.loading.done()),
+                    "active_requests": shard.active,
+                    "idle_seconds": now - shard.last_used,
+                    "generation": local_generation(shard),
+                }
+                for channel, shard in self.shards.items()
+            },
+        }
+
+
+def local_generation(shard: Shard) -> int:
+    with shard.entered():
+        return local(index_manager).generation
+
+
+shard_manager = ShardManager(
+    channels=SHARD_CHANNELS,
+    hosts=SHARD_HOSTS,
+    max_loaded=SHARD_MAX_LOADED,
+    idle_timeout=SHARD_IDLE_TIMEOUT,
+)
+
+
+class ShardMiddleware:
+    """
+    Runs requests for a channel other than the default one within that channel's shard.
+    """
+
+    def __init__(self, app: ASGIApp, manager: ShardManager = shard_manager):
+        self.app = app
+        self.manager = manager
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        channel, scope = self.manager.route(scope)
+        if channel is None or channel == AARS.channel:
+            return await self.app(scope, receive, send)
+        if channel not in self.manager.allowed:
+            response = JSONResponse({"detail": "Unknown channel"}, status_code=404)
+            return await response(scope, receive, send)
+        try:
+            shard = await self.manager.acquire(channel)
+        except Exception as e:
+            print(f"Failed to load channel {channel}: {e!r}")
+            response = JSONResponse(
+                {"detail": "Channel is currently unavailable"}, status_code=503
+            )
+            return await response(scope, receive, send)
+        try:
+            with shard.entered():
+                await self.app(scope, receive, send)
+        finally:
+            self.manager.release(shard)
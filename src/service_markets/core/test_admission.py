@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from . import admission
+from .admission import RateLimiter, TokenBucket, WriteGate, WriteQueueFull
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(tokens=2, now=0)
+
+    assert bucket.take(capacity=2, refill_rate=1, now=0)
+    assert bucket.take(capacity=2, refill_rate=1, now=0)
+    assert not bucket.take(capacity=2, refill_rate=1, now=0.5)
+    assert bucket.take(capacity=2, refill_rate=1, now=1)
+    bucket.take(capacity=2, refill_rate=1, now=100)
+    assert bucket.tokens == 1
+
+
+def test_rate_limiter_keys_by_wallet_and_route_and_drops_old_keys():
+    limiter = RateLimiter(capacity=1, refill_rate=1, max_keys=2)
+
+    assert limiter.allow("0xa", "PUT /services", now=0)
+    assert not limiter.allow("0xa", "PUT /services", now=0)
+    assert limiter.allow("0xa", "PUT /users", now=0)
+    assert limiter.allow("0xb", "PUT /services", now=0)
+
+    assert ("0xa", "PUT /services") not in limiter.buckets
+    assert limiter.rejected == {"PUT /services": 1}
+
+
+def admit(wallet_address: str):
+    request = Request(
+        {
+            "type": "http",
+            "method": "PUT",
+            "path": "/users",
+            "query_string": b"",
+            "headers": [],
+        }
+    )
+    return admission.admit_write(
+        request, SimpleNamespace(address=wallet_address)  # type: ignore
+    )
+
+
+def test_a_zero_rate_only_allows_the_burst(monkeypatch):
+    monkeypatch.setattr(
+        admission, "rate_limiter", RateLimiter(capacity=1, refill_rate=0, max_keys=10)
+    )
+
+    async def write_twice():
+        await admit("0xzero").__anext__()
+        await admit("0xzero").__anext__()
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(write_twice())
+    assert e.value.status_code == 429
+    assert e.value.headers is None
+
+
+def test_write_gate_rejects_beyond_the_queue():
+    gate = WriteGate(max_in_flight=1, max_queued=1, queue_timeout=1)
+    results = []
+
+    async def write():
+        try:
+            async with gate.slot():
+                await asyncio.sleep(0.01)
+            results.append("written")
+        except WriteQueueFull:
+            results.append("rejected")
+
+    async def main():
+        await asyncio.gather(write(), write(), write())
+
+    asyncio.run(main())
+
+    assert sorted(results) == ["rejected", "written", "written"]
+    assert gate.rejected_queue_full == 1
+    assert (gate.in_flight, gate.queued) == (0, 0)
@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from . import aleph_client
+from .aleph_client import (
+    AlephDeadlineExceeded,
+    AlephUnavailable,
+    CircuitBreaker,
+    DeadlineMiddleware,
+    ResilientAlephClient,
+    channel_override,
+    request_deadline,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(aleph_client.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_circuit_breaker_opens_and_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 1
+
+
+class FakeAlephClient:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls: List[dict] = []
+
+    async def get_posts(self, **kwargs):
+        self.calls.append(kwargs)
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("node unreachable")
+        return {"posts": []}
+
+
+def resilient(client: FakeAlephClient, **kwargs) -> ResilientAlephClient:
+    return ResilientAlephClient(
+        client,  # type: ignore
+        read_retries=2,
+        retry_base_delay=0,
+        **kwargs,
+    )
+
+
+def test_reads_are_retried_within_the_channel_of_the_request():
+    client = FakeAlephClient(failures=2)
+    session = resilient(client)
+
+    async def read():
+        channel_override.set("SERVICE_MARKETS_OTHER")
+        return await session.get_posts(channels=["SERVICE_MARKETS_TEST"])
+
+    assert asyncio.run(read()) == {"posts": []}
+    assert [call["channels"] for call in client.calls] == [
+        ["SERVICE_MARKETS_OTHER"]
+    ] * 3
+    assert session.counters["retries"] == 2
+
+
+def test_an_open_circuit_rejects_calls_without_reaching_aleph():
+    client = FakeAlephClient(failures=10)
+    session = resilient(client, breaker_threshold=3)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(session.get_posts())
+    with pytest.raises(AlephUnavailable):
+        asyncio.run(session.get_posts())
+    assert len(client.calls) == 3
+
+
+def test_calls_past_the_request_deadline_are_not_made():
+    client = FakeAlephClient()
+    session = resilient(client)
+
+    async def read():
+        request_deadline.set(time.monotonic() - 1)
+        return await session.get_posts()
+
+    with pytest.raises(AlephDeadlineExceeded):
+        asyncio.run(read())
+    assert client.calls == []
+
+
+class SlowAlephClient:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    async def get_posts(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"posts": []}
+
+
+def test_timeouts_of_short_caller_deadlines_do_not_open_the_circuit():
+    session = ResilientAlephClient(
+        SlowAlephClient(delay=0.2),  # type: ignore
+        read_retries=0,
+        default_timeout=30,
+        breaker_threshold=2,
+    )
+
+    async def read(timeout: float):
+        request_deadline.set(time.monotonic() + timeout)
+        return await session.get_posts()
+
+    for _ in range(3):
+        with pytest.raises(AlephDeadlineExceeded):
+            asyncio.run(read(0.05))
+    assert session.breaker.state == "closed"
+    assert asyncio.run(read(30)) == {"posts": []}
+
+
+def test_timeouts_of_the_node_open_the_circuit():
+    session = ResilientAlephClient(
+        SlowAlephClient(delay=0.2),  # type: ignore
+        read_retries=0,
+        default_timeout=0.05,
+        breaker_threshold=2,
+    )
+
+    for _ in range(2):
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(session.get_posts())
+    assert session.breaker.state == "open"
+
+
+def test_waiting_for_a_free_slot_counts_against_the_deadline():
+    client = SlowAlephClient(delay=0.2)
+    session = ResilientAlephClient(
+        client,  # type: ignore
+        max_concurrency=1,
+        read_retries=0,
+    )
+
+    async def read(timeout: float):
+        request_deadline.set(time.monotonic() + timeout)
+        return await session.get_posts()
+
+    async def concurrent_reads():
+        return await asyncio.gather(read(30), read(0.1), return_exceptions=True)
+
+    first, second = asyncio.run(concurrent_reads())
+    assert first == {"posts": []}
+    assert isinstance(second, AlephDeadlineExceeded)
+    assert client.calls == 1
+    assert session.in_flight == 0
+
+
+def test_client_timeouts_are_floored(clock):
+    deadlines = []
+
+    async def app(scope, receive, send):
+        deadlines.append(request_deadline.get())
+
+    middleware = DeadlineMiddleware(app, default_timeout=30, min_timeout=5)
+    for value in (b"0.05", b"10", b"60"):
+        scope = {"type": "http", "headers": [(b"x-request-timeout", value)]}
+        asyncio.run(middleware(scope, None, None))  # type: ignore
+
+    assert deadlines == [clock.now + 5, clock.now + 10, clock.now + 30]
@@ -0,0 +1,109 @@
+from typing import Any, Dict
+
+from .compact import CompactStore
+from ..conftest import random_hash
+from .model import Permission, VotableType, Vote, VoteType
+
+
+def make_permission(**kwargs) -> Permission:
+    item_hash = random_hash()
+    fields: Dict[str, Any] = {
+        "item_hash": item_hash,
+        "revision_hashes": [item_hash],
+        "user_address": "0xuser",
+        "service_id": "service",
+        "signer": "0xsigner",
+    }
+    fields.update(kwargs)
+    return Permission(**fields)
+
+
+def test_permissions_are_returned_as_indexed():
+    store = CompactStore()
+    permission = make_permission(tx_hash="0xtx", timestamp=1700000000.5)
+
+    store.add_record(permission)
+
+    rows = store.permissions.for_service("service")
+    assert [store.permissions.model(row) for row in rows] == [permission]
+    assert store.permissions.model(rows[0]).dict() == permission.dict()
+
+
+def test_permissions_without_timestamp_keep_none():
+    store = CompactStore()
+    store.add_record(make_permission())
+
+    (row,) = store.permissions.for_user("0xuser")
+    assert store.permissions.model(row).timestamp is None
+
+
+def test_amended_permissions_are_moved_and_keep_their_revisions():
+    store = CompactStore()
+    permission = make_permission()
+    store.add_record(permission)
+    amended = permission.copy(
+        update={
+            "service_id": "other",
+            "revision_hashes": [permission.item_hash, random_hash()],
+            "current_revision": 1,
+        }
+    )
+
+    store.add_record(amended)
+
+    assert len(store.permissions.for_service("service")) == 0
+    (row,) = store.permissions.for_service("other")
+    assert store.permissions.model(row).dict() == amended.dict()
+
+
+def make_vote(**kwargs) -> Vote:
+    item_hash = random_hash()
+    fields: Dict[str, Any] = {
+        "item_hash": item_hash,
+        "revision_hashes": [item_hash],
+        "item_id": "service",
+        "item_type": VotableType.SERVICE,
+        "user_address": "0xuser",
+        "vote": VoteType.UP,
+        "signer": "0xsigner",
+    }
+    fields.update(kwargs)
+    return Vote(**fields)
+
+
+def test_votes_are_found_by_item_and_user():
+    store = CompactStore()
+    vote = make_vote(timestamp=1700000000.5)
+    store.add_record(vote)
+    amended = vote.copy(
+        update={
+            "vote": VoteType.DOWN,
+            "revision_hashes": [vote.item_hash, random_hash()],
+            "current_revision": 1,
+        }
+    )
+
+    assert store.votes.get("service", "0xuser") == vote
+    store.add_record(amended)
+
+    found = store.votes.get("service", "0xuser")
+    assert found is not None
+    assert found.dict() == amended.dict()
+    assert not found.changed
+    assert store.votes.get("service", "0xother") is None
+    assert len(store.votes) == 1
+
+
+def test_memory_report_compares_models_and_columns_per_record_type():
+    store = CompactStore()
+    for _ in range(10):
+        store.add_record(make_permission())
+        store.add_record(make_vote(user_address=random_hash()))
+
+    report = store.memory_report()
+
+    assert report["interned_strings"] > 0
+    for record_type in ("Permission", "Vote"):
+        sizes = report[record_type]
+        assert sizes["records"] == 10
+        assert 0 < sizes["compact_bytes_per_record"] < sizes["model_bytes_per_record"]
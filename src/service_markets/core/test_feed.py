@@ -0,0 +1,35 @@
+from ..conftest import random_hash
+from .feed import ChangeFeed
+from .indexing import notify_listeners
+from .model import Comment, VotableType, Vote, VoteType
+
+
+def test_votes_on_comments_reach_subscribers_of_their_service(make_service):
+    service = make_service("0xowner-feed")
+    comment = Comment(
+        item_hash=random_hash(),
+        service_id=service.item_hash,
+        user_address="0xcommenter",
+        comment="Nice",
+    )
+    notify_listeners(service, comment)
+    feed = ChangeFeed(buffer_size=10, max_subscribers=10)
+    by_service = feed.subscribe({service.item_hash}, set(), set())
+    by_owner = feed.subscribe(set(), {"Vote"}, {"0xowner-feed"})
+    elsewhere = feed.subscribe({"other"}, set(), set())
+
+    feed.add_record(
+        Vote(
+            item_hash=random_hash(),
+            item_id=comment.item_hash,
+            item_type=VotableType.COMMENT,
+            user_address="0xvoter",
+            vote=VoteType.UP,
+        )
+    )
+
+    event = by_service.queue.get_nowait()
+    assert event["item_id"] == comment.item_hash
+    assert event["service_id"] == service.item_hash
+    assert by_owner.queue.get_nowait() == event
+    assert elsewhere.queue.empty()
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from aars import Record
+
+from .aleph_client import request_deadline
+from .generations import IndexGenerationManager, index_post
+from .indexing import listeners, local
+from .model import Service
+from .shards import Shard
+
+
+def test_index_post_indexes_and_notifies(make_service_post, recording_listener):
+    post = make_service_post("0xowner-index-post")
+
+    asyncio.run(index_post(post))
+
+    index = Service.get_index("Service.owner_address")
+    assert index.hashmap[("0xowner-index-post",)] == {post.item_hash}
+    assert [record.item_hash for record in recording_listener.records] == [
+        post.item_hash
+    ]
+
+
+def test_rebuild_ignores_the_request_deadline(
+    monkeypatch, make_service_post, sharded_indices
+):
+    posts = [make_service_post("0xowner-rebuild") for _ in range(2)]
+    deadlines = []
+
+    async def fetch_objects():
+        deadlines.append(request_deadline.get())
+        for post in posts:
+            yield await Service.from_post(post)
+
+    monkeypatch.setattr(Service, "fetch_objects", fetch_objects)
+    manager = IndexGenerationManager(record_types=(Service,))
+
+    async def reindex_within_request():
+        request_deadline.set(time.monotonic() - 1)
+        manager.start()
+        assert manager.task
+        await manager.task
+
+    with Shard("SERVICE_MARKETS_REBUILD").entered():
+        asyncio.run(reindex_within_request())
+        index = Service.get_index("Service.owner_address")
+        assert index.hashmap[("0xowner-rebuild",)] == {p.item_hash for p in posts}
+    assert deadlines == [None]
+    assert manager.generation == 1
+
+
+def test_redelivered_posts_are_indexed_once(make_service_post, recording_listener):
+    post = make_service_post("0xowner-redelivered")
+
+    asyncio.run(index_post(post))
+    asyncio.run(index_post(post))
+
+    assert Record.is_indexed(post.item_hash)
+    assert len(recording_listener.records) == 1
+
+
+def test_rebuild_swaps_in_buffered_records(
+    monkeypatch, make_service_post, sharded_indices
+):
+    fetched = make_service_post("0xowner-swap")
+    buffered = make_service_post("0xowner-swap")
+    manager = IndexGenerationManager(record_types=(Service,))
+
+    async def fetch_objects():
+        yield await Service.from_post(fetched)
+        # a message arriving while the next generation is being built
+        await index_post(buffered)
+
+    monkeypatch.setattr(Service, "fetch_objects", fetch_objects)
+
+    listeners.append(manager)
+    try:
+        with Shard("SERVICE_MARKETS_SWAP").entered():
+            shard_generations = local(manager)
+            asyncio.run(shard_generations.rebuild())
+            index = Service.get_index("Service.owner_address")
+            assert index.hashmap[("0xowner-swap",)] == {
+                fetched.item_hash,
+                buffered.item_hash,
+            }
+    finally:
+        listeners.remove(manager)
+    assert shard_generations.generation == 1
+    assert shard_generations.buffered == []
+    assert Record.is_indexed(fetched.item_hash)
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from typing import Dict, List
+
+from .heimdall import (
+    HeimdallMiddleware,
+    PrefixTrie,
+    RouteTable,
+    ServicePermissionAuth,
+)
+
+
+def test_prefix_trie_matches_paths_starting_with_a_prefix():
+    trie = PrefixTrie(["/docs", "/authorization"])
+
+    assert trie.matches("/docs")
+    assert trie.matches("/docs/oauth2-redirect")
+    assert trie.matches("/authorization/challenge")
+    assert not trie.matches("/doc")
+    assert not trie.matches("/services")
+    assert not trie.matches("")
+
+
+def test_an_empty_prefix_matches_every_path():
+    trie = PrefixTrie([""])
+
+    assert trie.matches("")
+    assert trie.matches("/services")
+
+
+def test_route_table_opens_exact_endpoints_and_prefixed_routes():
+    routes = RouteTable(open_routes=["/docs"], open_endpoints=["/"])
+
+    assert routes.is_open("/")
+    assert routes.is_open("/docs")
+    assert routes.is_open("/docs/oauth2-redirect")
+    assert not routes.is_open("/services")
+    assert not routes.is_open("/services/")
+
+
+def test_route_table_cache_is_reset_once_full():
+    routes = RouteTable(open_routes=[], open_endpoints=["/"], cache_size=2)
+
+    routes.is_open("/")
+    routes.is_open("/a")
+    assert list(routes.cache) == ["/", "/a"]
+    routes.is_open("/b")
+    assert routes.cache == {"/b": False}
+    assert routes.is_open("/")
+
+
+def test_protected_paths_without_a_token_are_forbidden():
+    reached: List[str] = []
+    sent: List[Dict] = []
+
+    async def app(scope, receive, send):
+        reached.append(scope["path"])
+
+    async def send(message):
+        sent.append(message)
+
+    backend = ServicePermissionAuth("https://example.com")
+    # already set up, so that no Aleph node is queried
+    backend.ready = True
+    middleware = HeimdallMiddleware(
+        app,
+        backend=backend,
+        open_routes=["/docs"],
+        open_endpoints=["/"],
+    )
+
+    for path in ("/", "/docs/index.html", "/protected"):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [],
+            "query_string": b"",
+        }
+        asyncio.run(middleware(scope, None, send))  # type: ignore
+
+    assert reached == ["/", "/docs/index.html"]
+    start, body = sent
+    assert start["status"] == 403
+    assert (b"content-type", b"application/json") in start["headers"]
+    assert json.loads(body["body"]) == {"detail": "Not authenticated"}
@@ -0,0 +1,110 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from .profiler import ProfileStore, ProfilerMiddleware, RequestProfile, collapsed_stacks
+
+
+def make_profile(id: str, duration: float = 1.0, stacks: str = "") -> RequestProfile:
+    return RequestProfile(
+        id=id,
+        method="GET",
+        path="/",
+        status_code=200,
+        started_at=0,
+        duration=duration,
+        stacks=stacks,
+    )
+
+
+def test_recent_profiles_are_evicted_by_count_and_bytes():
+    store = ProfileStore(max_profiles=2, slowest_n=0, max_bytes=10)
+
+    for id in ("a", "b", "c"):
+        store.add_recent(make_profile(id, stacks="xx"))
+    assert list(store.recent) == ["b", "c"]
+
+    store.add_recent(make_profile("d", stacks="x" * 9))
+    assert list(store.recent) == ["d"]
+    assert store.recent_bytes == 9
+
+
+def test_only_the_slowest_profiles_are_kept_within_bytes():
+    store = ProfileStore(max_profiles=0, slowest_n=2, max_bytes=10)
+
+    for id, duration in (("a", 3.0), ("b", 1.0), ("c", 2.0), ("d", 0.5)):
+        store.add_slow(make_profile(id, duration, stacks="xx"))
+    assert [p["id"] for p in store.summary()["slowest"]] == ["a", "c"]
+
+    store.add_slow(make_profile("e", 4.0, stacks="x" * 9))
+    assert [p["id"] for p in store.summary()["slowest"]] == ["e"]
+    assert store.get("e") is not None and store.get("a") is None
+
+
+def frame(function: str, time: float, children=()) -> SimpleNamespace:
+    return SimpleNamespace(
+        function=function,
+        file_path_short="app.py",
+        line_no=1,
+        time=time,
+        children=list(children),
+    )
+
+
+def test_collapsed_stacks_report_self_time_per_stack():
+    root = frame("main", 0.5, [frame("handler", 0.375, [frame("query", 0.25)])])
+    profiler = SimpleNamespace(last_session=SimpleNamespace(root_frame=lambda: root))
+
+    assert sorted(collapsed_stacks(profiler).splitlines()) == [  # type: ignore
+        "main (app.py:1) 125000",
+        "main (app.py:1);handler (app.py:1) 125000",
+        "main (app.py:1);handler (app.py:1);query (app.py:1) 250000",
+    ]
+    assert collapsed_stacks(SimpleNamespace(last_session=None)) is None
+
+
+def test_profiling_on_demand_preempts_sampling_the_slowest_requests(monkeypatch):
+    sampled = asyncio.Event()
+    responses: Dict[str, List] = {}
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/sampled":
+            sampled.set()
+            await asyncio.sleep(0.05)
+        elif scope["path"] == "/profiled":
+            deadline = time.perf_counter() + 0.02
+            while time.perf_counter() < deadline:
+                pass
+            # the overlapping request arrives meanwhile
+            await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    store = ProfileStore(max_profiles=10, slowest_n=10, max_bytes=1024 * 1024)
+    middleware = ProfilerMiddleware(app, store)
+    monkeypatch.setattr(
+        middleware, "requested", lambda scope: scope["path"] != "/sampled"
+    )
+
+    async def request(path: str):
+        async def send(message):
+            responses[path] = message["headers"]
+
+        scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+        await middleware(scope, None, send)  # type: ignore
+
+    async def requests():
+        sampled_request = asyncio.ensure_future(request("/sampled"))
+        await sampled.wait()
+        await asyncio.gather(request("/profiled"), request("/overlapping"))
+        await sampled_request
+
+    asyncio.run(requests())
+
+    (profile_id,) = [v for k, v in responses["/profiled"] if k == b"x-profile-id"]
+    profile = store.get(profile_id.decode())
+    assert profile is not None and profile.stacks is not None
+    assert (b"x-profile-status", b"not-sampled") in responses["/overlapping"]
+    (preempted,) = [p for p in store.summary()["slowest"] if p["path"] == "/sampled"]
+    assert store.get(preempted["id"]).stacks is None  # type: ignore
+    assert middleware.current is None
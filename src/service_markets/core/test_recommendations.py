@@ -0,0 +1,103 @@
+import asyncio
+from ..conftest import random_hash
+from .model import Permission, Service
+from .indexing import local
+from .recommendations import (
+    RelatedServices,
+    recompute_periodically,
+    top_k_python,
+    top_k_sparse,
+)
+from .shards import Shard, ShardManager
+
+
+def buy(related: RelatedServices, buyer: str, service: Service):
+    assert service.item_hash is not None
+    related.add_record(
+        Permission(
+            item_hash=random_hash(),
+            user_address=buyer,
+            service_id=service.item_hash,
+        )
+    )
+
+
+def test_incremental_lists_match_the_full_recomputation(make_service):
+    related = RelatedServices(k=2, max_incremental_candidates=100)
+    ai, ml, storage = (
+        make_service(tags=["ai", "gpu"]),
+        make_service(tags=["ai", "training"]),
+        make_service(tags=["storage"]),
+    )
+    for service in (ai, ml, storage):
+        related.add_record(service)
+    buy(related, "0xbuyer1", ai)
+    buy(related, "0xbuyer1", ml)
+    buy(related, "0xbuyer2", ai)
+    buy(related, "0xbuyer2", ml)
+    buy(related, "0xbuyer2", storage)
+    assert ai.item_hash is not None
+
+    also_bought, similar = related.related(ai.item_hash)
+    assert also_bought == [(ml.item_hash, 2), (storage.item_hash, 1)]
+    assert similar == [(ml.item_hash, 1 / 3)]
+    assert not related.stale
+
+    incremental = (dict(related.also_bought), dict(related.similar))
+    asyncio.run(related.recompute())
+    assert related.related(ai.item_hash) == (also_bought, similar)
+    assert (related.also_bought[ml.item_hash], related.similar[ml.item_hash]) == (
+        incremental[0][ml.item_hash],
+        incremental[1][ml.item_hash],
+    )
+
+
+def test_sparse_and_python_recomputations_agree():
+    purchases = {
+        "0xbuyer1": {"a", "b", "c"},
+        "0xbuyer2": {"a", "b"},
+        "0xbuyer3": {"c", "d"},
+    }
+    tags = {
+        "a": frozenset({"ai", "gpu"}),
+        "b": frozenset({"ai"}),
+        "c": frozenset({"gpu", "storage"}),
+        "d": frozenset({"storage"}),
+    }
+
+    def ranked(lists):
+        # the order of tied scores is unspecified
+        return {service: sorted(neighbours) for service, neighbours in lists.items()}
+
+    sparse_lists = top_k_sparse(purchases, tags, k=3)
+    python_lists = top_k_python(purchases, tags, k=3)
+    assert [ranked(lists) for lists in sparse_lists] == [
+        ranked(lists) for lists in python_lists
+    ]
+    assert python_lists[1]["a"] == [("b", 0.5), ("c", 1 / 3)]
+
+
+def test_loaded_channels_are_recomputed_periodically(monkeypatch):
+    related = RelatedServices(k=2, max_incremental_candidates=100)
+    manager = ShardManager(["SERVICE_MARKETS_RELATED"], {}, 1, 60)
+    shard = manager.shards["SERVICE_MARKETS_RELATED"] = Shard("SERVICE_MARKETS_RELATED")
+    with shard.entered():
+        shard_related = local(related)
+    shard_related.stale = True
+    recomputed = []
+
+    async def recompute(self):
+        recomputed.append(self)
+        self.stale = False
+
+    monkeypatch.setattr(RelatedServices, "recompute", recompute)
+
+    async def run_once():
+        task = asyncio.ensure_future(recompute_periodically(related, 0, manager))
+        while not recomputed:
+            await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(run_once())
+
+    assert recomputed == [shard_related]
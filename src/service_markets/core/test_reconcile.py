@@ -0,0 +1,79 @@
+import asyncio
+from typing import List
+
+from aars import Record
+
+from ..conftest import random_hash
+from . import reconcile as reconcile_module
+from .indexing import notify_listeners
+from .model import Payment, Permission, Service
+from .reconcile import ReconcileCheckpoint, reconcile
+from .shards import Shard
+
+
+def test_unattributed_payments_are_retried(monkeypatch, tmp_path, make_service):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    owner = "0xowner-reconcile"
+    services = [make_service(owner), make_service(owner)]
+    raw_payment = {
+        "id": "1",
+        "contractAddress": "0xcontract",
+        "tokenAddress": "0xtoken",
+        "txHash": "0xtx-reconcile",
+        "to": owner,
+        "from": "0xbuyer",
+        "amount": "100",
+        "reference": "reference",
+        "timestamp": "1700000000",
+    }
+    subgraph = [raw_payment]
+    saved: List[Record] = []
+
+    async def fetch_payments(to_addresses, since, after_id, batch_size):
+        assert owner in to_addresses
+        return [raw for raw in subgraph if int(raw["timestamp"]) > since]
+
+    async def fetch_payments_by_tx_hashes(tx_hashes):
+        return []
+
+    async def save(self):
+        self.item_hash = random_hash()
+        saved.append(self)
+        return self
+
+    async def fetch_objects():
+        raise AssertionError("reconciling must not read the channel")
+
+    for record_type in (Service, Payment, Permission):
+        monkeypatch.setattr(record_type, "fetch_objects", fetch_objects)
+    monkeypatch.setattr(reconcile_module, "fetch_payments", fetch_payments)
+    monkeypatch.setattr(
+        reconcile_module, "fetch_payments_by_tx_hashes", fetch_payments_by_tx_hashes
+    )
+    monkeypatch.setattr(Record, "save", save)
+
+    with Shard("SERVICE_MARKETS_RECONCILE").entered():
+        notify_listeners(*services)
+        # the receiving address owns two services, so the payment cannot be attributed
+        report = asyncio.run(reconcile(checkpoint_path=checkpoint_path))
+
+        assert report.unattributed_tx_hashes == ["0xtx-reconcile"]
+        assert saved == []
+        checkpoint = ReconcileCheckpoint.load(checkpoint_path)
+        assert checkpoint.timestamp == 1700000000
+        assert list(checkpoint.unattributed) == ["0xtx-reconcile"]
+
+        assert services[1].item_hash is not None
+        notify_listeners(make_service("0xother", item_hash=services[1].item_hash))
+        report = asyncio.run(reconcile(checkpoint_path=checkpoint_path))
+
+        assert report.unattributed_tx_hashes == []
+        assert (report.payments_created, report.permissions_created) == (1, 1)
+        payment, permission = saved
+        assert isinstance(payment, Payment) and isinstance(permission, Permission)
+        assert payment.service_id == permission.service_id == services[0].item_hash
+        assert ReconcileCheckpoint.load(checkpoint_path).unattributed == {}
+
+        # the saved records are indexed, so nothing is missing anymore
+        report = asyncio.run(reconcile(checkpoint_path=checkpoint_path, full=True))
+        assert (report.payments_created, report.permissions_created) == (0, 0)
@@ -0,0 +1,102 @@
+from decimal import Decimal
+from typing import Optional
+
+import pytest
+from aars import Record
+
+from ..conftest import random_hash
+from .indexing import IndexListener, listeners, notify_listeners
+from .model import Payment, Permission
+from .sales_stats import SalesStats
+
+
+def make_payment(
+    amount: str, service_id: Optional[str], timestamp: float = 1700000000.0
+) -> Payment:
+    return Payment.parse_obj(
+        {
+            "item_hash": random_hash(),
+            "contractAddress": "0xcontract",
+            "tokenAddress": "0xtoken",
+            "txHash": random_hash(),
+            "to": "0xowner",
+            "from": "0xbuyer",
+            "amount": amount,
+            "reference": "reference",
+            "service_id": service_id,
+            "timestamp": timestamp,
+        }
+    )
+
+
+def test_revenue_is_summed_as_decimals(make_service):
+    stats = SalesStats()
+    stats.add_record(
+        make_service(
+            item_hash="service",
+            price=1.5,
+        )
+    )
+    stats.add_record(
+        Permission(
+            item_hash=random_hash(),
+            user_address="0xbuyer",
+            service_id="service",
+            timestamp=1700000000.0,
+        )
+    )
+
+    stats.add_record(make_payment("1.5", "service"))
+    stats.add_record(make_payment("1000000000000000000", "service"))
+    stats.add_record(make_payment("not an amount", "service"))
+
+    total = stats.owners["0xowner"].total
+    assert total.sales == 1
+    assert total.revenue == {"0xtoken": Decimal("1000000000000000001.5")}
+
+
+class FailingListener(IndexListener):
+    record_types = (Payment,)
+
+    def add_record(self, record: Record):
+        raise ValueError(record)
+
+    def clear(self):
+        pass
+
+
+@pytest.fixture
+def failing_listener():
+    listener = FailingListener()
+    listeners.insert(0, listener)
+    yield listener
+    listeners.remove(listener)
+
+
+def test_failing_listeners_do_not_fail_indexing(failing_listener, recording_listener):
+    recording_listener.record_types = (Payment,)
+    payment = make_payment("1", "service")
+
+    notify_listeners(payment)
+
+    assert recording_listener.records == [payment]
+
+
+def test_payments_are_attributed_once_the_service_pointing_to_them_is_indexed(
+    make_service,
+):
+    stats = SalesStats()
+    payment = make_payment("2", None)
+    stats.add_record(payment)
+    assert list(stats.unattributed_tx_hashes) == [payment.item_hash]
+
+    stats.add_record(
+        make_service(
+            item_hash="service",
+            price=2,
+            payment_id=payment.item_hash,
+        )
+    )
+
+    assert stats.unattributed_payments == stats.unattributed_tx_hashes == {}
+    assert stats.owners["0xowner"].total.revenue == {"0xtoken": Decimal(2)}
@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+from .aleph_client import request_deadline
+from .generations import index_manager, index_post
+from .indexing import ShardedHashmap, local, replace_hashmap
+from .model import Service
+from .shards import Shard, ShardManager, shard_manager
+
+
+def test_shards_keep_their_own_indices_and_listeners(
+    make_service_post, recording_listener, sharded_indices
+):
+    index = Service.get_index("Service.owner_address")
+    assert isinstance(index.hashmap, ShardedHashmap)
+    shard = Shard("SERVICE_MARKETS_OTHER")
+    default_post = make_service_post("0xowner-shards")
+    shard_post = make_service_post("0xowner-shards", channel=shard.channel)
+
+    asyncio.run(index_post(default_post))
+    with shard.entered():
+        asyncio.run(index_post(shard_post))
+
+    assert index.hashmap[("0xowner-shards",)] == {default_post.item_hash}
+    assert [r.item_hash for r in recording_listener.records] == [default_post.item_hash]
+    with shard.entered():
+        assert index.hashmap[("0xowner-shards",)] == {shard_post.item_hash}
+        assert [r.item_hash for r in local(recording_listener).records] == [
+            shard_post.item_hash
+        ]
+
+
+def test_replacing_a_shard_hashmap_leaves_the_default_one(
+    make_service_post, sharded_indices
+):
+    index = Service.get_index("Service.owner_address")
+    asyncio.run(index_post(make_service_post("0xowner-replace")))
+    shard = Shard("SERVICE_MARKETS_OTHER")
+
+    with shard.entered():
+        replace_hashmap(index, {("0xowner-replace",): {"shard"}})
+
+    assert index.hashmap[("0xowner-replace",)] != {"shard"}
+    with shard.entered():
+        assert index.hashmap[("0xowner-replace",)] == {"shard"}
+
+
+def test_loading_a_shard_ignores_the_request_deadline(
+    monkeypatch, make_service_post, sharded_indices
+):
+    post = make_service_post("0xowner-load", channel="SERVICE_MARKETS_LOAD")
+    deadlines = []
+
+    async def fetch_objects():
+        deadlines.append(request_deadline.get())
+        yield await Service.from_post(post)
+
+    monkeypatch.setattr(Service, "fetch_objects", fetch_objects)
+    monkeypatch.setattr(index_manager, "record_types", (Service,))
+    manager = ShardManager(["SERVICE_MARKETS_LOAD"], {}, 1, 60)
+    monkeypatch.setattr(manager, "_restart_watcher", lambda: None)
+
+    async def first_request():
+        request_deadline.set(time.monotonic() - 1)
+        return await manager.acquire("SERVICE_MARKETS_LOAD")
+
+    shard = asyncio.run(first_request())
+
+    assert deadlines == [None]
+    with shard.entered():
+        index = Service.get_index("Service.owner_address")
+        assert index.hashmap[("0xowner-load",)] == {post.item_hash}
+
+
+def test_least_recently_used_idle_shards_are_evicted(monkeypatch, sharded_indices):
+    async def fetch_objects():
+        return
+        yield
+
+    monkeypatch.setattr(Service, "fetch_objects", fetch_objects)
+    monkeypatch.setattr(index_manager, "record_types", (Service,))
+    manager = ShardManager(["A", "B", "C"], {}, 2, 60)
+    monkeypatch.setattr(manager, "_restart_watcher", lambda: None)
+
+    async def requests():
+        for channel in ("A", "B"):
+            manager.release(await manager.acquire(channel))
+        busy = await manager.acquire("A")
+        await manager.acquire("C")
+        manager.release(busy)
+
+    asyncio.run(requests())
+
+    assert list(manager.shards) == ["A", "C"]
+    assert (manager.loads, manager.evictions) == (3, 1)
+
+
+def test_cancelled_requests_release_a_loading_shard(monkeypatch, sharded_indices):
+    loaded = asyncio.Event()
+
+    async def fetch_objects():
+        await loaded.wait()
+        return
+        yield
+
+    monkeypatch.setattr(Service, "fetch_objects", fetch_objects)
+    monkeypatch.setattr(index_manager, "record_types", (Service,))
+    manager = ShardManager(["A"], {}, 1, 60)
+    monkeypatch.setattr(manager, "_restart_watcher", lambda: None)
+
+    async def disconnecting_request():
+        request = asyncio.ensure_future(manager.acquire("A"))
+        await asyncio.sleep(0)
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        shard = manager.shards["A"]
+        assert shard.active == 0
+        loaded.set()
+        assert shard.loading is not None
+        await shard.loading
+
+    asyncio.run(disconnecting_request())
+
+    assert manager.loads == 1
+
+
+def test_uninstalling_restores_the_default_hashmaps(make_service_post):
+    index = Service.get_index("Service.owner_address")
+    post = make_service_post("0xowner-uninstall")
+    shard_manager.install()
+    asyncio.run(index_post(post))
+
+    shard_manager.uninstall()
+
+    assert not isinstance(index.hashmap, ShardedHashmap)
+    assert index.hashmap[("0xowner-uninstall",)] == {post.item_hash}